@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Benchmark and accuracy check of the matching engine on synthetic libraries.
+
+Run from the repository root:
+    python benchmarks/bench_matching.py [--sizes 1000 10000] [--queries 1000]
+
+For each library size the script builds an in-memory PlexLibraryIndex (no
+Plex server involved) and matches a noisy playlist against it through
+find_best_match(), the same path the importer takes. The playlist entries
+carry the noise real exports have: featured artists added or dropped,
+slash titles, remaster tags, accents and case, typos, a leading "The", and
+tracks that aren't in the library at all. Every entry has a known correct
+answer (a rating key, or none), so precision and recall are exact.
+
+Reported per size: index build time, queries/sec, p50/p99 latency per
+match tier, peak memory (max RSS) and precision/recall overall and per
+kind of noise. The script exits non-zero when precision or recall drop
+below the configured minimums, or, with --baseline, when throughput,
+memory, precision or recall regress past the allowed margin against a
+saved run (--save-baseline).
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plex_playlist_importer.library_index import PlexLibraryIndex
+from plex_playlist_importer.index_records import ArtistRecord, AlbumRecord, TrackRecord
+from plex_playlist_importer.string_utils import normalize_string
+from plex_playlist_importer.track_finder import find_best_match
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+
+# Accuracy below these fails the run. They sit just under the lowest the engine reaches today over the
+# default sizes (precision 0.975, recall 0.787 at 100000 tracks): recall is held back by typos and
+# " - Remastered" suffixes, which it mostly can't recover from yet
+MIN_PRECISION = 0.97
+MIN_RECALL = 0.78
+
+# Allowed regression against a --baseline run: share of queries/sec lost, share of memory gained
+MAX_SLOWDOWN = 0.25
+MAX_MEMORY_GROWTH = 0.25
+# ... and precision or recall lost; the playlists are seeded, so only matching changes move these
+MAX_ACCURACY_LOSS = 0.005
+
+THRESHOLD = 0.55  # main.py's default --threshold
+
+SYLLABLES = ("ka lo mi ra ne su ti va do re shi an el or um ber cal den fro gra hel jun kor lin mar nov "
+             "pel quin ros sta tur vel wyn yar zel bri cha dru fen gor hal ist jor kel lum").split()
+COMMON_WORDS = ("love night dance heart fire rain blue sky dream world time life girl baby home gone light "
+                "dark run away summer city river golden silver wild young lost song with you me my").split()
+ACCENTS = {'a': 'á', 'e': 'é', 'i': 'í', 'o': 'ö', 'u': 'ü', 'n': 'ñ'}
+REMASTER_TAGS = (" - Remastered 2011", " (2009 Remaster)", " (Remastered)", " - 2015 Remaster")
+
+# Kinds of playlist noise and how often each is drawn
+NOISE_WEIGHTS = {
+    'exact': 10, 'case': 10, 'accent': 10, 'feat': 15, 'slash': 10,
+    'remaster': 15, 'typo': 10, 'article': 5, 'missing': 15,
+}
+
+class SyntheticLibrary:
+    """Artists, albums and tracks as plain tuples, cheap enough to generate a million of."""
+    
+    def __init__(self, size, seed=0):
+        rnd = random.Random(seed)
+        vocabulary = self._vocabulary(rnd, max(500, size // 20))
+        
+        self.artists = []  # (rating key, name)
+        for i in range(max(1, size // 20)):
+            name = ' '.join(rnd.choice(vocabulary) for _ in range(rnd.randint(1, 2))).title()
+            if rnd.random() < 0.1:
+                name = f"The {name}"
+            self.artists.append((i + 1, f"{name} {_roman(i)}"))
+        
+        self.albums = []  # (rating key, artist index, title)
+        key = len(self.artists) + 1
+        for i in range(max(1, size // 10)):
+            self.albums.append((key, i % len(self.artists), f"{rnd.choice(vocabulary).title()} {_roman(i)}"))
+            key += 1
+        
+        self.tracks = []  # (rating key, artist index, album index, title, duration in ms)
+        seen = set()
+        for i in range(size):
+            album_index = rnd.randrange(len(self.albums))
+            artist_index = self.albums[album_index][1]
+            while True:
+                words = [rnd.choice(COMMON_WORDS if rnd.random() < 0.3 else vocabulary)
+                         for _ in range(rnd.randint(1, 4))]
+                title = ' '.join(words).title()
+                roll = rnd.random()
+                if roll < 0.05 and len(words) > 1:
+                    half = len(words) // 2
+                    title = ' '.join(words[:half]).title() + ' / ' + ' '.join(words[half:]).title()
+                elif roll < 0.10:
+                    title += f" (feat. {self.artists[rnd.randrange(len(self.artists))][1]})"
+                elif roll < 0.13:
+                    title += rnd.choice(REMASTER_TAGS)
+                if (artist_index, normalize_string(title)) not in seen:
+                    break
+            seen.add((artist_index, normalize_string(title)))
+            self.tracks.append((key, artist_index, album_index, title, rnd.randint(120, 420) * 1000))
+            key += 1
+        self.vocabulary = vocabulary
+    
+    def _vocabulary(self, rnd, count):
+        """Made-up words, some with accents, so large libraries don't run out of distinct titles."""
+        words = set()
+        while len(words) < count:
+            word = ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(1, 3)))
+            if rnd.random() < 0.1:
+                i = rnd.randrange(len(word))
+                word = word[:i] + ACCENTS.get(word[i], word[i]) + word[i + 1:]
+            words.add(word)
+        return sorted(words)
+    
+    def build_index(self):
+        """Fill a PlexLibraryIndex as build_index() would, without a Plex server."""
+        library_index = PlexLibraryIndex(None)
+        library_index.index_paths = False
+        for rating_key, name in self.artists:
+            library_index._add_artist(ArtistRecord(rating_key, name))
+        for rating_key, _, title in self.albums:
+            library_index.albums[rating_key] = AlbumRecord(rating_key, title)
+        for rating_key, artist_index, album_index, title, duration in self.tracks:
+            library_index._add_track(TrackRecord(rating_key, title, normalize_string(title),
+                                                 self.artists[artist_index][0], self.albums[album_index][0],
+                                                 duration))
+        library_index.initialized = True
+        return library_index
+
+def _roman(number):
+    """Short unique suffix keeping generated names distinct."""
+    digits = ''
+    number += 1
+    while number:
+        number, digit = divmod(number, 26)
+        digits += chr(ord('a') + digit)
+    return digits.capitalize()
+
+def strip_accents(text):
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+def typo(text, rnd):
+    """Swap two neighbouring letters of the longest word."""
+    words = text.split(' ')
+    i = max(range(len(words)), key=lambda i: len(words[i]))
+    word = words[i]
+    if len(word) < 5:
+        return text
+    j = rnd.randrange(1, len(word) - 2)
+    words[i] = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+    return ' '.join(words)
+
+def make_queries(library, count, seed=1):
+    """Noisy playlist entries with their correct answers: [(noise, track_info, rating key or None)]."""
+    rnd = random.Random(seed)
+    kinds = list(NOISE_WEIGHTS)
+    weights = [NOISE_WEIGHTS[kind] for kind in kinds]
+    slash_tracks = [track for track in library.tracks if ' / ' in track[3]]
+    accent_tracks = [track for track in library.tracks if strip_accents(track[3]) != track[3]]
+    the_tracks = [track for track in library.tracks if library.artists[track[1]][1].startswith('The ')]
+    
+    queries = []
+    for _ in range(count):
+        kind = rnd.choices(kinds, weights)[0]
+        pool = {'slash': slash_tracks, 'accent': accent_tracks, 'article': the_tracks}.get(kind) or library.tracks
+        rating_key, artist_index, album_index, title, duration = rnd.choice(pool)
+        artist = library.artists[artist_index][1]
+        expected = rating_key
+        
+        if kind == 'case':
+            title, artist = title.lower(), artist.upper()
+        elif kind == 'accent':
+            title = strip_accents(title)
+        elif kind == 'feat':
+            if ' (feat. ' in title:
+                title = title.split(' (feat. ')[0]
+            else:
+                title += f" feat. {library.artists[rnd.randrange(len(library.artists))][1]}"
+        elif kind == 'slash':
+            title = title.replace(' / ', '/')
+        elif kind == 'remaster':
+            tags = [tag for tag in REMASTER_TAGS if title.endswith(tag)]
+            title = title[:-len(tags[0])] if tags else title + rnd.choice(REMASTER_TAGS)
+        elif kind == 'typo':
+            title = typo(title, rnd)
+        elif kind == 'article':
+            artist = artist[len('The '):]
+        elif kind == 'missing':
+            title = ' '.join(rnd.choice(library.vocabulary) for _ in range(3)).title() + " Unreleased"
+            expected = None
+        
+        track_info = {
+            'artist': artist,
+            'album': library.albums[album_index][2] if rnd.random() < 0.5 else None,
+            'title': title,
+            'path': f"{artist} - {title}.mp3",
+            'extension': '.mp3',
+            'duration': duration // 1000 + rnd.randint(-2, 2) if rnd.random() < 0.5 else None,
+        }
+        queries.append((kind, track_info, expected))
+    return queries
+
+def peak_memory_mb():
+    """Peak resident memory of the process so far, or None where it can't be read."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024  # Bytes on macOS, KiB elsewhere
+
+def run_queries(library_index, queries):
+    """Match every query; return [(noise, expected, got, tier, seconds)]."""
+    results = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for kind, track_info, expected in queries:
+            start = time.perf_counter()
+            match = find_best_match(None, track_info, library_index, THRESHOLD)
+            elapsed = time.perf_counter() - start
+            results.append((kind, expected, match['track'].rating_key if match else None,
+                            match.get('tier') if match else 'miss', elapsed))
+    return results
+
+def accuracy(results):
+    """Return (precision, recall) of (expected, got) pairs."""
+    true_pos = sum(1 for _, expected, got, _, _ in results if got is not None and got == expected)
+    false_pos = sum(1 for _, expected, got, _, _ in results if got is not None and got != expected)
+    false_neg = sum(1 for _, expected, got, _, _ in results if expected is not None and got != expected)
+    precision = true_pos / (true_pos + false_pos) if true_pos + false_pos else 1.0
+    recall = true_pos / (true_pos + false_neg) if true_pos + false_neg else 1.0
+    return precision, recall
+
+def bench_size(size, query_count):
+    """Build, match and report one library size; return its summary."""
+    start = time.perf_counter()
+    library = SyntheticLibrary(size)
+    generated = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    library_index = library.build_index()
+    built = time.perf_counter() - start
+    print(f"{size} tracks: generated in {generated:.2f} s, indexed in {built:.2f} s "
+          f"({len(library_index.artists)} artists)")
+    
+    run_queries(library_index, make_queries(library, 20, seed=99))  # Builds the lazy trigram indexes
+    queries = make_queries(library, query_count)
+    start = time.perf_counter()
+    results = run_queries(library_index, queries)
+    elapsed = time.perf_counter() - start
+    
+    by_tier = defaultdict(list)
+    for _, _, _, tier, seconds in results:
+        by_tier[tier].append(seconds * 1000)
+    precision, recall = accuracy(results)
+    memory = peak_memory_mb()
+    
+    print(f"  {len(results) / elapsed:9.1f} queries/sec, precision {precision:.3f}, recall {recall:.3f}, "
+          f"peak memory {f'{memory:.0f} MB' if memory is not None else 'n/a'}")
+    for tier, latencies in sorted(by_tier.items(), key=lambda item: -len(item[1])):
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"  {tier:<10} {len(latencies):6d} queries  p50 {p50:8.2f} ms  p99 {p99:8.2f} ms")
+    
+    by_noise = defaultdict(list)
+    for result in results:
+        by_noise[result[0]].append(result)
+    print("  by noise: " + ", ".join(f"{kind} {sum(1 for r in rs if r[1] == r[2]) / len(rs):.2f}"
+                                      for kind, rs in sorted(by_noise.items())))
+    
+    return {'build_seconds': built, 'queries_per_sec': len(results) / elapsed, 'precision': precision,
+            'recall': recall, 'peak_memory_mb': memory}
+
+def check_limits(summaries, args):
+    """Print every limit the run breaks; return how many."""
+    failures = []
+    for size, summary in summaries.items():
+        if summary['precision'] < args.min_precision:
+            failures.append(f"{size}: precision {summary['precision']:.3f} < {args.min_precision}")
+        if summary['recall'] < args.min_recall:
+            failures.append(f"{size}: recall {summary['recall']:.3f} < {args.min_recall}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        for size, summary in summaries.items():
+            base = baseline.get(size)
+            if base is None:
+                continue
+            if summary['queries_per_sec'] < base['queries_per_sec'] * (1 - args.max_slowdown):
+                failures.append(f"{size}: {summary['queries_per_sec']:.1f} queries/sec, baseline "
+                                f"{base['queries_per_sec']:.1f}")
+            if (summary['peak_memory_mb'] and base.get('peak_memory_mb')
+                    and summary['peak_memory_mb'] > base['peak_memory_mb'] * (1 + args.max_memory_growth)):
+                failures.append(f"{size}: peak memory {summary['peak_memory_mb']:.0f} MB, baseline "
+                                f"{base['peak_memory_mb']:.0f} MB")
+            for measure in ('precision', 'recall'):
+                if summary[measure] < base[measure] - args.max_accuracy_loss:
+                    failures.append(f"{size}: {measure} {summary[measure]:.3f}, baseline {base[measure]:.3f}")
+    
+    for failure in failures:
+        print(f"  LIMIT {failure}")
+    return len(failures)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Library sizes in tracks')
+    parser.add_argument('--queries', type=int, default=1000, help='Playlist entries matched per size')
+    parser.add_argument('--min-precision', type=float, default=MIN_PRECISION)
+    parser.add_argument('--min-recall', type=float, default=MIN_RECALL)
+    parser.add_argument('--baseline', help='JSON file of an earlier --save-baseline run to compare with')
+    parser.add_argument('--save-baseline', help='Write this run\'s results to a JSON file')
+    parser.add_argument('--max-slowdown', type=float, default=MAX_SLOWDOWN)
+    parser.add_argument('--max-memory-growth', type=float, default=MAX_MEMORY_GROWTH)
+    parser.add_argument('--max-accuracy-loss', type=float, default=MAX_ACCURACY_LOSS)
+    args = parser.parse_args()
+    
+    # Smaller libraries first, so the running peak memory belongs to the size just measured
+    summaries = {}
+    for size in sorted(args.sizes):
+        summaries[str(size)] = bench_size(size, args.queries)
+    
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(summaries, f, indent=2)
+        print(f"Baseline saved to: {args.save_baseline}")
+    
+    failures = check_limits(summaries, args)
+    if failures:
+        print(f"{failures} limits exceeded")
+        sys.exit(1)
+    print("ok")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the importer's network paths against a local fake Plex server.
+
+Run from the repository root:
+    python benchmarks/bench_plex_io.py [--tracks 10000] [--latency 0.02] [--error-rate 0.1]
+
+The script serves a synthetic library with benchmarks/fake_plex_server.py,
+points PlexServer at it and times building the library index (bulk at
+several concurrency levels, and per artist), refreshing it after changes
+and syncing a playlist. Each run is checked against the served library;
+the index has to come out the same at every concurrency level and with
+injected 503 errors, and the script exits non-zero on any mismatch.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plexapi.server import PlexServer
+
+from fake_plex_server import FakeLibrary, FakePlexServer
+from plex_playlist_importer.library_index import PlexLibraryIndex
+from plex_playlist_importer.playlist_sync import PlaylistCatalog, sync_playlist
+from plex_playlist_importer.plex_requests import mount_request_layer
+
+def connect(server, concurrency):
+    """Open a PlexServer on the fake server, with the request layer main.py installs."""
+    session = requests.Session()
+    layer = mount_request_layer(session, concurrency)
+    return PlexServer(server.url, server.token, session=session), layer
+
+def build(server, concurrency, bulk=True, page_size=1000):
+    """Build an index quietly; return it with the seconds and requests it took."""
+    plex, _ = connect(server, concurrency)
+    library_index = PlexLibraryIndex(plex)
+    server.reset_counts()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        library_index.build_index(bulk=bulk, page_size=page_size, concurrency=concurrency)
+    return library_index, time.perf_counter() - start, server.requests
+
+def index_state(library_index):
+    """Comparable contents of an index."""
+    return ({key: (track.title, track.artist_key, track.album_key, track.duration, track.path_key)
+             for key, track in library_index.tracks.items()},
+            {key: artist.title for key, artist in library_index.artists.items()},
+            {key: album.title for key, album in library_index.albums.items()})
+
+def check_against_library(label, library_index, library):
+    """Compare an index with the served library; return the number of mismatches."""
+    tracks, artists, _ = index_state(library_index)
+    expected = {key: (attrs['title'], attrs['grandparentRatingKey'], attrs['parentRatingKey'],
+                      attrs['duration']) for key, attrs in library.tracks.items()}
+    got = {key: track[:4] for key, track in tracks.items()}
+    mismatches = len(expected.keys() ^ got.keys())
+    mismatches += sum(1 for key in expected.keys() & got.keys() if expected[key] != got[key])
+    mismatches += len(library.artists.keys() ^ artists.keys())
+    if mismatches:
+        print(f"  MISMATCH {label}: {mismatches} items differ from the served library")
+    return mismatches
+
+def report(label, seconds, request_count, extra=""):
+    print(f"  {label:<36} {seconds * 1000:9.1f} ms {request_count:7d} requests{extra}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--tracks', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.1, help='Share of 503 responses in the error run')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--playlist-size', type=int, default=2000)
+    args = parser.parse_args()
+    
+    library = FakeLibrary(tracks=args.tracks)
+    mismatches = 0
+    print(f"Fake library: {len(library.tracks)} tracks, {len(library.artists)} artists, "
+          f"{len(library.albums)} albums; {args.latency * 1000:.0f} ms per response")
+    
+    with FakePlexServer(library, latency=args.latency) as server:
+        print("build_index (bulk, 1000 per page)")
+        reference = None
+        for concurrency in args.concurrency:
+            library_index, seconds, request_count = build(server, concurrency)
+            report(f"concurrency {concurrency}", seconds, request_count)
+            mismatches += check_against_library(f"bulk, concurrency {concurrency}", library_index, library)
+            if reference is None:
+                reference = index_state(library_index)
+            elif index_state(library_index) != reference:
+                print(f"  MISMATCH index at concurrency {concurrency} differs from concurrency "
+                      f"{args.concurrency[0]}")
+                mismatches += 1
+        
+        print("build_index (per artist)")
+        concurrency = max(args.concurrency)
+        per_artist, seconds, request_count = build(server, concurrency, bulk=False)
+        report(f"concurrency {concurrency}", seconds, request_count)
+        if index_state(per_artist)[0] != reference[0]:
+            print("  MISMATCH per-artist index differs from the bulk index")
+            mismatches += 1
+        
+        print("refresh_index (1% renamed, some in the second of the last change, 0.5% deleted)")
+        library_index, _, _ = build(server, concurrency)
+        library.rename_tracks(10, seed=3, advance=0)
+        library.rename_tracks(len(library.tracks) // 100)
+        library.delete_tracks(len(library.tracks) // 200)
+        server.reset_counts()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = library_index.refresh_index(concurrency=concurrency)
+        report(f"concurrency {concurrency}", time.perf_counter() - start, server.requests,
+               f"  ({stats['updated']} updated, {stats['removed']} removed)")
+        mismatches += check_against_library("refreshed index", library_index, library)
+        
+        print(f"sync_playlist ({args.playlist_size} tracks)")
+        plex, _ = connect(server, concurrency)
+        rnd = random.Random(0)
+        keys = rnd.sample(sorted(library.tracks), min(args.playlist_size, len(library.tracks)))
+        edited = keys[:]
+        for _ in range(max(1, len(keys) // 100)):  # About 1% of tracks replaced, 1% moved
+            edited[rnd.randrange(len(edited))] = rnd.choice(keys)
+            edited.insert(rnd.randrange(len(edited)), edited.pop(rnd.randrange(len(edited))))
+        for label, target in (("create", keys), ("sync 2% edit", edited), ("sync unchanged", edited)):
+            server.reset_counts()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = sync_playlist(plex, PlaylistCatalog(plex), 'Benchmark', target)
+            report(label, time.perf_counter() - start, server.requests,
+                   f"  ({stats['added']} added, {stats['removed']} removed, {stats['moved']} moved)")
+            if server.playlist_tracks('Benchmark') != target:
+                print(f"  MISMATCH playlist order after {label}")
+                mismatches += 1
+    
+    print(f"build_index (200 per page) with {args.error_rate:.0%} of responses failing with 503")
+    library = FakeLibrary(tracks=args.tracks)
+    with FakePlexServer(library, latency=args.latency, error_rate=args.error_rate) as server:
+        concurrency = max(args.concurrency)
+        plex, layer = connect(server, concurrency)
+        library_index = PlexLibraryIndex(plex)
+        server.reset_counts()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            library_index.build_index(page_size=200, concurrency=concurrency)
+        report(f"concurrency {concurrency}", time.perf_counter() - start, server.requests,
+               f"  ({server.errors} failed, {layer.retried} retried)")
+        mismatches += check_against_library("index built with errors", library_index, library)
+    
+    if mismatches:
+        print(f"{mismatches} mismatches")
+        sys.exit(1)
+    print("ok")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the normalization and similarity helpers in string_utils.
+
+Run from the repository root:
+    python benchmarks/bench_string_utils.py
+
+Before timing anything, the script checks that get_multi_similarity with a
+score_cutoff returns exactly the uncut score for every pair that reaches the
+cutoff (and 0.0 otherwise) and that score_matrix agrees with it pair by
+pair, and exits non-zero if it finds a mismatch.
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plex_playlist_importer import string_utils
+from plex_playlist_importer.string_utils import (normalize_string, get_multi_similarity, clean_title_for_search,
+                                                score_matrix)
+
+WORDS = ("love night dance heart fire rain blue sky dream world time life girl baby home "
+         "gone light dark run away with you me my the of in on café señor über").split()
+
+def make_titles(count, seed=0):
+    """Generate playlist-like titles with accents, features and remaster tags."""
+    rnd = random.Random(seed)
+    titles = []
+    for _ in range(count):
+        title = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 5))).title()
+        if rnd.random() < 0.2:
+            title += ' (Remastered 2011)'
+        if rnd.random() < 0.1:
+            title += ' feat. ' + rnd.choice(WORDS).title()
+        titles.append(title)
+    return titles
+
+CUTOFFS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9)
+
+def mutate(title, rnd):
+    """Return a noisy copy of a title with a few typos, swaps or drops."""
+    chars = list(title)
+    for _ in range(rnd.randint(0, 3)):
+        if not chars:
+            break
+        i = rnd.randrange(len(chars))
+        op = rnd.random()
+        if op < 0.4:
+            chars[i] = rnd.choice('abcdefghijklmnopqrstuvwxyzéü ')
+        elif op < 0.7:
+            del chars[i]
+        else:
+            chars.insert(i, rnd.choice('aeiou'))
+    return ''.join(chars)
+
+def make_pairs(titles, seed=1):
+    """Pair titles with unrelated titles and with noisy copies of themselves."""
+    rnd = random.Random(seed)
+    pairs = list(zip(titles, reversed(titles)))
+    pairs += [(t, mutate(t, rnd)) for t in titles]
+    return pairs
+
+def check_cutoff_equivalence(pairs):
+    """Compare cutoff scores with the uncut score; return the number of mismatches."""
+    uncached_similarity = string_utils._multi_similarity.__wrapped__
+    mismatches = 0
+    for a, b in pairs:
+        for normalized in (False, True):
+            if normalized:
+                a, b = normalize_string(a), normalize_string(b)
+            full = uncached_similarity(a, b, normalized)
+            for cutoff in CUTOFFS:
+                expected = full if full >= cutoff else 0.0
+                got = uncached_similarity(a, b, normalized, cutoff)
+                if got != expected:
+                    mismatches += 1
+                    print(f"  MISMATCH {a!r} / {b!r} cutoff={cutoff}: {got} != {expected}")
+    return mismatches
+
+def check_matrix_equivalence(queries, candidates):
+    """Compare score_matrix with get_multi_similarity; return the number of mismatches."""
+    uncached_similarity = string_utils._multi_similarity.__wrapped__
+    mismatches = 0
+    for normalized in (False, True):
+        if normalized:
+            queries = [normalize_string(q) for q in queries]
+            candidates = [normalize_string(c) for c in candidates]
+        for cutoff in (None,) + CUTOFFS:
+            scores = score_matrix(queries, candidates, normalized, cutoff)
+            for i, a in enumerate(queries):
+                for j, b in enumerate(candidates):
+                    expected = uncached_similarity(a, b, normalized, cutoff)
+                    if scores[i, j] != expected:
+                        mismatches += 1
+                        print(f"  MISMATCH {a!r} / {b!r} cutoff={cutoff}: {scores[i, j]} != {expected}")
+    return mismatches
+
+def bench(label, func, repeat=5):
+    """Print the best per-call time of func over several runs."""
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    print(f"  {label:<45} {best * 1000:9.2f} ms")
+    return best
+
+def main():
+    titles = make_titles(2000)
+    
+    check_pairs = make_pairs(make_titles(5000, seed=2), seed=3)
+    print(f"score_cutoff equivalence x {len(check_pairs)} pairs x {len(CUTOFFS)} cutoffs")
+    mismatches = check_cutoff_equivalence(check_pairs)
+    if mismatches:
+        print(f"  {mismatches} mismatches")
+        sys.exit(1)
+    print("  ok")
+    
+    candidates = [title for pair in make_pairs(make_titles(200, seed=4), seed=5) for title in pair]
+    candidates += ["", "Café (Live)", "Über (Live Version)", "a_b c"]
+    queries = candidates[::10]
+    print(f"score_matrix equivalence x {len(queries)} x {len(candidates)} x {len(CUTOFFS) + 1} cutoffs")
+    mismatches = check_matrix_equivalence(queries, candidates)
+    if mismatches:
+        print(f"  {mismatches} mismatches")
+        sys.exit(1)
+    print("  ok")
+    
+    pairs = list(zip(titles, reversed(titles)))
+    norm_pairs = [(normalize_string(a), normalize_string(b)) for a, b in pairs]
+    
+    uncached_normalize = normalize_string.__wrapped__
+    uncached_clean = clean_title_for_search.__wrapped__
+    uncached_similarity = string_utils._multi_similarity.__wrapped__
+    
+    print(f"normalize_string x {len(titles)}")
+    base = bench("uncached", lambda: [uncached_normalize(t) for t in titles])
+    fast = bench("memoized (warm)", lambda: [normalize_string(t) for t in titles])
+    print(f"  speedup: {base / fast:.1f}x")
+    
+    print(f"clean_title_for_search x {len(titles)}")
+    base = bench("uncached", lambda: [uncached_clean(t) for t in titles])
+    fast = bench("memoized (warm)", lambda: [clean_title_for_search(t) for t in titles])
+    print(f"  speedup: {base / fast:.1f}x")
+    
+    print(f"get_multi_similarity x {len(pairs)}")
+    base = bench("uncached, raw input", lambda: [uncached_similarity(a, b, False) for a, b in pairs])
+    pre = bench("uncached, normalized=True", lambda: [uncached_similarity(a, b, True) for a, b in norm_pairs])
+    fast = bench("memoized (warm), normalized=True",
+                 lambda: [get_multi_similarity(a, b, normalized=True) for a, b in norm_pairs])
+    print(f"  speedup from skipping normalization: {base / pre:.1f}x")
+    print(f"  speedup with memo: {base / fast:.1f}x")
+    
+    cut_pairs = [(normalize_string(a), normalize_string(b)) for a, b in make_pairs(titles)]
+    print(f"get_multi_similarity with score_cutoff x {len(cut_pairs)}")
+    base = bench("uncached, no cutoff", lambda: [uncached_similarity(a, b, True) for a, b in cut_pairs])
+    for cutoff in (0.7, 0.85):
+        fast = bench(f"uncached, score_cutoff={cutoff}",
+                     lambda: [uncached_similarity(a, b, True, cutoff) for a, b in cut_pairs])
+        print(f"  speedup: {base / fast:.1f}x")
+    
+    queries = [normalize_string(t) for t in titles[:50]]
+    pool = [normalize_string(t) for t in titles]
+    print(f"score_matrix {len(queries)} x {len(pool)}")
+    for cutoff in (None, 0.8):
+        base = bench(f"uncached pairwise, score_cutoff={cutoff}",
+                     lambda: [uncached_similarity(a, b, True, cutoff) for a in queries for b in pool], repeat=1)
+        fast = bench(f"score_matrix, score_cutoff={cutoff}",
+                     lambda: score_matrix(queries, pool, normalized=True, score_cutoff=cutoff), repeat=1)
+        print(f"  speedup: {base / fast:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a Plex Media Server, for offline benchmarks and checks.
+
+It serves a synthetic music library over HTTP, speaking the subset of the
+Plex XML API that plexapi and the importer use: the server root, library
+sections, paged section listings (with updatedAt filters), metadata
+lookups and children, and audio playlists (create, list, add, remove,
+move, delete). Every response can be delayed and a share of them
+answered with 503 to exercise the retry and throttling paths.
+
+Use it in-process:
+
+    with FakePlexServer(FakeLibrary(tracks=10000), latency=0.02) as server:
+        plex = PlexServer(server.url, server.token)
+
+or serve a library for a manual run of main.py:
+
+    python benchmarks/fake_plex_server.py --tracks 100000 --port 32400
+    python main.py --url http://127.0.0.1:32400 --token fake ...
+"""
+
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, unquote
+from xml.etree import ElementTree as ET
+
+SECTION_KEY = 1
+MACHINE_IDENTIFIER = 'fake-plex-server'
+
+# Plex metadata type numbers of section listings
+TYPE_NUMBERS = {'8': 'artist', '9': 'album', '10': 'track'}
+
+WORDS = ("love night dance heart fire rain blue sky dream world time life girl baby home "
+         "gone light dark run away summer city river golden silver wild young lost song "
+         "café señor über naïve beyoncé").split()
+
+class FakeLibrary:
+    """Synthetic music library: artists, their albums and tracks, with stable rating keys.
+
+    The same ``seed`` always gives the same library. Track titles carry
+    the noise real libraries have (featured artists, remaster tags,
+    accents), and every track has a duration and a media file path of the
+    form "Artist/Album/NN - Title.flac".
+    """
+    
+    def __init__(self, tracks=1000, artists=None, tracks_per_album=10, seed=0):
+        rnd = random.Random(seed)
+        artist_count = artists or max(1, tracks // 50)
+        album_count = max(artist_count, -(-tracks // tracks_per_album))
+        
+        self.lock = threading.Lock()
+        self.updated_at = 1_600_000_000
+        self.artists = {}  # Maps rating key to item attributes
+        self.albums = {}
+        self.tracks = {}
+        next_key = iter(range(1, 1 << 62))
+        
+        artist_keys = []
+        for i in range(artist_count):
+            name = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 3))).title()
+            key = next(next_key)
+            self.artists[key] = {'ratingKey': key, 'title': f"{name} {i}", 'updatedAt': self.updated_at}
+            artist_keys.append(key)
+        
+        album_keys = []
+        for i in range(album_count):
+            artist_key = artist_keys[i % artist_count]
+            key = next(next_key)
+            self.albums[key] = {'ratingKey': key, 'title': f"{rnd.choice(WORDS).title()} Album {i}",
+                                'parentRatingKey': artist_key, 'updatedAt': self.updated_at}
+            album_keys.append(key)
+        
+        for i in range(tracks):
+            album = self.albums[album_keys[i % album_count]]
+            artist = self.artists[album['parentRatingKey']]
+            title = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 4))).title() + f" {i}"
+            if rnd.random() < 0.1:
+                title += f" (feat. {rnd.choice(WORDS).title()})"
+            if rnd.random() < 0.1:
+                title += " (Remastered 2011)"
+            key = next(next_key)
+            index = i // album_count + 1
+            self.tracks[key] = {'ratingKey': key, 'title': title, 'index': index,
+                                'parentRatingKey': album['ratingKey'], 'grandparentRatingKey': artist['ratingKey'],
+                                'duration': rnd.randint(120, 420) * 1000, 'updatedAt': self.updated_at,
+                                'file': f"/music/{artist['title']}/{album['title']}/{index:02d} - {title}.flac"}
+        self.next_key = next_key
+    
+    def items(self, libtype):
+        """Return the attribute dicts of one item type, in rating key order."""
+        return list({'artist': self.artists, 'album': self.albums, 'track': self.tracks}[libtype].values())
+    
+    def rename_tracks(self, count, seed=1, advance=60):
+        """Retitle ``count`` random tracks and mark them updated; return their rating keys.
+
+        The library clock moves ``advance`` seconds first; with 0 the tracks
+        change within the second of the last change.
+        """
+        rnd = random.Random(seed)
+        with self.lock:
+            self.updated_at += advance
+            keys = rnd.sample(sorted(self.tracks), min(count, len(self.tracks)))
+            for key in keys:
+                self.tracks[key]['title'] += ' (Live)'
+                self.tracks[key]['updatedAt'] = self.updated_at
+        return keys
+    
+    def delete_tracks(self, count, seed=2):
+        """Delete ``count`` random tracks; return their rating keys."""
+        rnd = random.Random(seed)
+        with self.lock:
+            keys = rnd.sample(sorted(self.tracks), min(count, len(self.tracks)))
+            for key in keys:
+                del self.tracks[key]
+        return keys
+
+class FakePlexServer:
+    """In-process HTTP server answering Plex API requests from a FakeLibrary.
+
+    Every request waits ``latency`` seconds plus up to ``jitter`` more, and
+    ``error_rate`` of the requests (drawn from a seeded generator) are
+    answered with ``error_status`` instead. ``requests`` and ``errors``
+    count what was received and what was failed on purpose.
+    """
+    
+    token = 'fake-token'
+    
+    def __init__(self, library=None, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503,
+                 host='127.0.0.1', port=0, seed=0):
+        self.library = library if library is not None else FakeLibrary()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.playlists = {}  # Maps rating key to {'title', 'items': [(track rating key, playlist item id)]}
+        self.next_item_id = 1
+        
+        handler = type('Handler', (_Handler,), {'fake': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+    
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+    
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+    
+    def reset_counts(self):
+        with self.lock:
+            self.requests = self.errors = 0
+    
+    def playlist_tracks(self, title):
+        """Return the track rating keys of the playlist with this title, in order, or None."""
+        with self.lock:
+            for playlist in self.playlists.values():
+                if playlist['title'] == title:
+                    return [rating_key for rating_key, _ in playlist['items']]
+        return None
+    
+    def _should_fail(self):
+        """Count a request and decide whether to fail it."""
+        with self.lock:
+            self.requests += 1
+            fail = self.error_rate > 0 and self.random.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        return fail
+    
+    # Request handling; each returns an XML element, or None for an empty 200 response
+    
+    def handle(self, method, path, params, headers):
+        start = int(params.get('X-Plex-Container-Start') or headers.get('X-Plex-Container-Start') or 0)
+        size = params.get('X-Plex-Container-Size') or headers.get('X-Plex-Container-Size')
+        size = int(size) if size is not None else None
+        
+        if path in ('', '/'):
+            return _container(machineIdentifier=MACHINE_IDENTIFIER, friendlyName='Fake Plex',
+                              version='1.40.0.0000', platform='Linux', myPlex='0')
+        if path == '/identity':
+            return _container(machineIdentifier=MACHINE_IDENTIFIER, version='1.40.0.0000')
+        if path == '/library':
+            return _container(title1='Plex Library')
+        if path == '/library/sections':
+            root = _container(size=1)
+            ET.SubElement(root, 'Directory', key=str(SECTION_KEY), type='artist', title='Music',
+                          agent='tv.plex.agents.music', scanner='Plex Music', language='en-US',
+                          uuid='fake-section', updatedAt=str(self.library.updated_at))
+            return root
+        
+        match = re.fullmatch(r'/library/sections/(\d+)/(all|collections)', path)
+        if match:
+            if match.group(2) == 'collections':
+                return _page([], start, size)
+            root = self._section_listing(params, start, size)
+            if params.get('includeMeta') == '1':
+                # Item types of the section, which plexapi reads before searching it
+                meta = ET.SubElement(root, 'Meta')
+                for number, libtype in TYPE_NUMBERS.items():
+                    elem = ET.SubElement(meta, 'Type', key=f"/library/sections/{SECTION_KEY}/all?type={number}",
+                                         type=libtype, title=f"{libtype.title()}s",
+                                         active='1' if number == '8' else '0')
+                    if libtype == 'album':
+                        # Artist.albums() searches albums by artist.id
+                        ET.SubElement(elem, 'Field', key='artist.id', title='Artist', type='integer')
+                field_type = ET.SubElement(meta, 'FieldType', type='integer')
+                ET.SubElement(field_type, 'Operator', key='=', title='is')
+            return root
+        
+        match = re.fullmatch(r'/library/metadata/([\d,]+)(/children)?', path)
+        if match:
+            keys = [int(key) for key in match.group(1).split(',')]
+            if match.group(2):
+                return self._children(keys[0], start, size)
+            return _page([item for item in map(self._lookup, keys) if item is not None], start, size)
+        
+        if path.startswith('/playlists'):
+            with self.lock:
+                return self._playlists(method, path, params, start, size)
+        return 404
+    
+    def _section_listing(self, params, start, size):
+        libtype = TYPE_NUMBERS.get(params.get('type', '8'), 'artist')
+        with self.library.lock:
+            items = self.library.items(libtype)
+        since = params.get('updatedAt>>')
+        if since is not None:
+            items = [item for item in items if item['updatedAt'] > int(since)]  # Strictly after, as in Plex
+        if 'artist.id' in params:
+            items = [item for item in items if item['parentRatingKey'] == int(params['artist.id'])]
+        return _page([(libtype, item) for item in items], start, size)
+    
+    def _lookup(self, rating_key):
+        library = self.library
+        for libtype, table in (('track', library.tracks), ('album', library.albums), ('artist', library.artists)):
+            if rating_key in table:
+                return libtype, table[rating_key]
+        return None
+    
+    def _children(self, rating_key, start, size):
+        library = self.library
+        if rating_key in library.artists:
+            children = [('album', album) for album in library.albums.values()
+                        if album['parentRatingKey'] == rating_key]
+        else:
+            children = [('track', track) for track in library.tracks.values()
+                        if track['parentRatingKey'] == rating_key]
+        return _page(children, start, size)
+    
+    def _playlists(self, method, path, params, start, size):
+        if path == '/playlists':
+            if method == 'POST':
+                rating_key = next(self.library.next_key)
+                self.playlists[rating_key] = {'title': params.get('title', ''), 'items': []}
+                self._add_items(rating_key, params.get('uri', ''))
+                return _page([('playlist', self._playlist_attrs(rating_key))], 0, None)
+            playlists = [('playlist', self._playlist_attrs(rating_key)) for rating_key in self.playlists]
+            return _page(playlists, start, size)
+        
+        match = re.fullmatch(r'/playlists/(\d+)(/items)?(?:/(\d+))?(/move)?', path)
+        if not match or int(match.group(1)) not in self.playlists:
+            return 404
+        rating_key = int(match.group(1))
+        items = self.playlists[rating_key]['items']
+        
+        if not match.group(2):
+            if method == 'DELETE':
+                del self.playlists[rating_key]
+                return None
+            return _page([('playlist', self._playlist_attrs(rating_key))], 0, None)
+        
+        if match.group(3) is None:
+            if method == 'PUT':
+                self._add_items(rating_key, params.get('uri', ''))
+                return _page([('playlist', self._playlist_attrs(rating_key))], 0, None)
+            entries = [('track', dict(self.library.tracks.get(track_key, {'ratingKey': track_key}),
+                                      playlistItemID=item_id))
+                       for track_key, item_id in items]
+            return _page(entries, start, size)
+        
+        item_ids = [item_id for _, item_id in items]
+        item_id = int(match.group(3))
+        if item_id not in item_ids:
+            return 404
+        entry = items.pop(item_ids.index(item_id))
+        if method == 'DELETE':
+            return None
+        
+        after = params.get('after')
+        position = 0
+        if after is not None:
+            position = [item_id for _, item_id in items].index(int(after)) + 1
+        items.insert(position, entry)
+        return None
+    
+    def _add_items(self, rating_key, uri):
+        """Append the tracks of a "server://.../library/metadata/1,2,3" URI to a playlist."""
+        keys = uri.rsplit('/library/metadata/', 1)[-1]
+        for key in filter(None, keys.split(',')):
+            self.playlists[rating_key]['items'].append((int(key), self.next_item_id))
+            self.next_item_id += 1
+    
+    def _playlist_attrs(self, rating_key):
+        playlist = self.playlists[rating_key]
+        return {'ratingKey': rating_key, 'key': f"/playlists/{rating_key}/items", 'title': playlist['title'],
+                'type': 'playlist', 'playlistType': 'audio', 'smart': 0, 'leafCount': len(playlist['items'])}
+
+class _Handler(BaseHTTPRequestHandler):
+    """Routes requests to the FakePlexServer set as the ``fake`` class attribute."""
+    
+    protocol_version = 'HTTP/1.1'  # Keep-alive, as a real Plex server
+    disable_nagle_algorithm = True  # Headers and body are written separately
+    fake = None
+    
+    def do_GET(self):
+        self._respond('GET')
+    
+    def do_POST(self):
+        self._respond('POST')
+    
+    def do_PUT(self):
+        self._respond('PUT')
+    
+    def do_DELETE(self):
+        self._respond('DELETE')
+    
+    def _respond(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        
+        if self.fake._should_fail():
+            self._send(self.fake.error_status, b'')
+            return
+        
+        parts = urlsplit(self.path)
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        result = self.fake.handle(method, unquote(parts.path).rstrip('/') or '/', params, self.headers)
+        if isinstance(result, int):
+            self._send(result, b'')
+        elif result is None:
+            self._send(200, b'')
+        else:
+            self._send(200, ET.tostring(result, encoding='utf-8'), 'text/xml;charset=utf-8')
+    
+    def _send(self, status, body, content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def _container(**attrs):
+    return ET.Element('MediaContainer', {key: str(value) for key, value in attrs.items()})
+
+def _page(items, start, size):
+    """MediaContainer holding one page of (libtype, attributes) items."""
+    page = items[start:] if size is None else items[start:start + size]
+    root = _container(size=len(page), totalSize=len(items), offset=start)
+    for libtype, attrs in page:
+        root.append(_element(libtype, attrs))
+    return root
+
+def _element(libtype, attrs):
+    """XML element of one item, as Plex lists it."""
+    attrs = {key: str(value) for key, value in attrs.items() if value is not None}
+    file = attrs.pop('file', None)
+    rating_key = attrs['ratingKey']
+    if libtype == 'playlist':
+        return ET.Element('Playlist', attrs)
+    
+    attrs.setdefault('type', libtype)
+    attrs['key'] = f"/library/metadata/{rating_key}" + ('' if libtype == 'track' else '/children')
+    attrs['librarySectionID'] = str(SECTION_KEY)
+    if libtype != 'track':
+        return ET.Element('Directory', attrs)
+    
+    elem = ET.Element('Track', attrs)
+    if file is not None:
+        media = ET.SubElement(elem, 'Media', id=rating_key, duration=attrs.get('duration', '0'))
+        ET.SubElement(media, 'Part', id=rating_key, file=file, duration=attrs.get('duration', '0'))
+    return elem
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic music library over a fake Plex API')
+    parser.add_argument('--tracks', type=int, default=10000, help='Number of tracks in the library')
+    parser.add_argument('--artists', type=int, help='Number of artists (default: one per 50 tracks)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated library')
+    parser.add_argument('--port', type=int, default=32400, help='Port to listen on')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Up to this many more seconds, at random')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 503')
+    args = parser.parse_args()
+    
+    library = FakeLibrary(tracks=args.tracks, artists=args.artists, seed=args.seed)
+    server = FakePlexServer(library, args.latency, args.jitter, args.error_rate, port=args.port)
+    print(f"Serving {len(library.tracks)} tracks by {len(library.artists)} artists at {server.url} "
+          f"(token: {server.token})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,7 @@ import argparse
 import traceback
 
 try:
+    import requests
     from plexapi.server import PlexServer
 except ImportError as e:
     print(f"Error: Missing required package - {e}")
@@ -16,6 +17,8 @@ except ImportError as e:
     sys.exit(1)
 
 from plex_playlist_importer.process_functions import process_playlist, process_playlist_folder
+from plex_playlist_importer.library_index import DURATION_TOLERANCE, DEFAULT_PAGE_SIZE
+from plex_playlist_importer.plex_requests import DEFAULT_CONCURRENCY, DEFAULT_RETRIES, mount_request_layer
 
 def main():
     parser = argparse.ArgumentParser(description='Import M3U8 playlist(s) to Plex using advanced matching')
@@ -31,13 +34,37 @@ def main():
     parser.add_argument('--no-create', action='store_true', help='Don\'t create playlists, just find matches')
     parser.add_argument('--threshold', type=float, default=0.55, help='Match confidence threshold (0.0-1.0)')
     parser.add_argument('--yes', '-y', action='store_true', help='Skip all confirmation prompts')
+    parser.add_argument('--index-cache', metavar='PATH', help='Load/save the library index snapshot at this path')
+    parser.add_argument('--rebuild-index', action='store_true', help='Rebuild the library index even if a snapshot exists')
+    parser.add_argument('--refresh-index', action='store_true', help='Apply library changes since the snapshot was saved')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Match playlist entries in N worker processes')
+    parser.add_argument('--playlist-workers', type=int, default=0, metavar='N',
+                        help='Folder mode: create playlists and write reports on N background threads (needs --yes or --no-create)')
+    parser.add_argument('--match-cache', metavar='PATH',
+                        help='Reuse match results from earlier runs stored at this path')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='Folder mode: match each distinct track once across all playlists')
+    parser.add_argument('--duration-tolerance', type=int, default=DURATION_TOLERANCE, metavar='SECONDS',
+                        help='Only consider tracks within this many seconds of the #EXTINF duration (0 to disable)')
+    parser.add_argument('--index-concurrency', type=int, default=DEFAULT_CONCURRENCY, metavar='N',
+                        help='Keep N Plex requests in flight while building or refreshing the library index')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, metavar='N',
+                        help='Number of items requested per page while building the library index')
+    parser.add_argument('--request-retries', type=int, default=DEFAULT_RETRIES, metavar='N',
+                        help='Retry Plex requests that time out or hit a busy server up to N times')
+    parser.add_argument('--request-budget', type=int, metavar='N',
+                        help='Stop the run after N Plex requests (retries included)')
     
     args = parser.parse_args()
     
     try:
         # Connect to Plex
+        # Every Plex request goes through the retrying, rate-adapting request layer
         print(f"Connecting to Plex server: {args.url}")
-        plex = PlexServer(args.url, args.token)
+        session = requests.Session()
+        request_layer = mount_request_layer(session, args.index_concurrency, args.request_retries,
+                                            args.request_budget)
+        plex = PlexServer(args.url, args.token, session=session)
         print(f"Connected to Plex server: {plex.friendlyName}")
         
         if args.file:
@@ -49,7 +76,15 @@ def main():
                 create_playlist=not args.no_create,
                 playlist_name=args.playlist_name,
                 verbose=args.verbose,
-                skip_confirmation=args.yes
+                skip_confirmation=args.yes,
+                index_cache=args.index_cache,
+                rebuild_index=args.rebuild_index,
+                refresh_index=args.refresh_index,
+                workers=args.workers,
+                match_cache=args.match_cache,
+                duration_tolerance=args.duration_tolerance,
+                index_concurrency=args.index_concurrency,
+                page_size=args.page_size
             )
         else:
             # Folder mode
@@ -59,9 +94,20 @@ def main():
                 threshold=args.threshold,
                 create_playlists=not args.no_create,
                 verbose=args.verbose,
-                skip_confirmation=args.yes
+                skip_confirmation=args.yes,
+                index_cache=args.index_cache,
+                rebuild_index=args.rebuild_index,
+                refresh_index=args.refresh_index,
+                workers=args.workers,
+                playlist_workers=args.playlist_workers,
+                dedupe=args.dedupe,
+                match_cache=args.match_cache,
+                duration_tolerance=args.duration_tolerance,
+                index_concurrency=args.index_concurrency,
+                page_size=args.page_size
             )
         
+        print(request_layer.summary())
         return 0
         
     except Exception as e:
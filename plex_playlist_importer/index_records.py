@@ -0,0 +1,68 @@
+import sys
+
+from .string_utils import normalize_string, get_base_title, clean_title_for_search
+
+
+def _shared(norm_title, value):
+    """Reuse the normalized title string when a derived title is identical to it."""
+    return norm_title if value == norm_title else sys.intern(value)
+
+
+class ArtistRecord:
+    """An artist as kept in the library index."""
+    __slots__ = ('rating_key', 'title', 'norm_title')
+    
+    def __init__(self, rating_key, title, norm_title=None):
+        self.rating_key = rating_key
+        self.title = sys.intern(title)
+        self.norm_title = sys.intern(normalize_string(title) if norm_title is None else norm_title)
+    
+    def __repr__(self):
+        return f"<ArtistRecord:{self.rating_key}:{self.title}>"
+
+
+class AlbumRecord:
+    """An album as kept in the library index."""
+    __slots__ = ('rating_key', 'title', 'norm_title')
+    
+    def __init__(self, rating_key, title, norm_title=None):
+        self.rating_key = rating_key
+        self.title = sys.intern(title)
+        self.norm_title = sys.intern(normalize_string(title) if norm_title is None else norm_title)
+    
+    def __repr__(self):
+        return f"<AlbumRecord:{self.rating_key}:{self.title}>"
+
+
+class TrackRecord:
+    """A track as kept in the library index.
+
+    Artist and album are referenced by rating key. The full Plex ``Track`` is
+    only fetched for matched tracks, see ``PlexLibraryIndex.fetch_tracks()``.
+    The normalized, base and cleaned titles are worked out once here so
+    matching never has to normalize indexed titles again.
+    """
+    __slots__ = ('rating_key', 'title', 'norm_title', 'base_title', 'clean_title',
+                 'artist_key', 'album_key', 'duration', 'path_key')
+    
+    def __init__(self, rating_key, title, norm_title, artist_key, album_key=None, duration=None,
+                 base_title=None, clean_title=None, path_key=None):
+        self.rating_key = rating_key
+        self.title = sys.intern(title)
+        self.norm_title = sys.intern(norm_title)
+        self.base_title = _shared(self.norm_title, get_base_title(norm_title) if base_title is None else base_title)
+        self.clean_title = _shared(self.norm_title, normalize_string(clean_title_for_search(title))
+                                   if clean_title is None else clean_title)
+        self.artist_key = artist_key
+        self.album_key = album_key
+        self.duration = duration  # Milliseconds
+        self.path_key = path_key  # get_path_key() of the media file, when paths are indexed
+    
+    def same_as(self, other):
+        """Check whether two records describe the same indexed data."""
+        return (self.rating_key == other.rating_key and self.title == other.title
+                and self.artist_key == other.artist_key and self.album_key == other.album_key
+                and self.duration == other.duration and self.path_key == other.path_key)
+    
+    def __repr__(self):
+        return f"<TrackRecord:{self.rating_key}:{self.title}>"
@@ -0,0 +1,245 @@
+import contextlib
+import gc
+import os
+import sqlite3
+import time
+
+from .index_records import ArtistRecord, AlbumRecord, TrackRecord
+
+# Bump whenever the stored layout or the meaning of a stored column changes
+SCHEMA_VERSION = 7
+
+_SCHEMA = """
+CREATE TABLE snapshots (
+    id INTEGER PRIMARY KEY,
+    machine_identifier TEXT NOT NULL,
+    section_key TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_updated INTEGER,
+    index_paths INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (machine_identifier, section_key)
+);
+CREATE TABLE artists (
+    snapshot_id INTEGER NOT NULL,
+    rating_key INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    norm_title TEXT NOT NULL
+);
+CREATE TABLE artist_aliases (
+    snapshot_id INTEGER NOT NULL,
+    alias TEXT NOT NULL,
+    canonical TEXT NOT NULL
+);
+CREATE TABLE artist_canonical (
+    snapshot_id INTEGER NOT NULL,
+    canonical_key TEXT NOT NULL,
+    norm_title TEXT NOT NULL
+);
+CREATE TABLE albums (
+    snapshot_id INTEGER NOT NULL,
+    rating_key INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    norm_title TEXT NOT NULL
+);
+CREATE TABLE tracks (
+    snapshot_id INTEGER NOT NULL,
+    rating_key INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    norm_title TEXT NOT NULL,
+    base_title TEXT,
+    clean_title TEXT,
+    artist_key INTEGER NOT NULL,
+    album_key INTEGER,
+    duration INTEGER,
+    path_key TEXT,
+    canonical_keys TEXT NOT NULL
+);
+CREATE TABLE skipped_tracks (
+    snapshot_id INTEGER NOT NULL,
+    rating_key INTEGER NOT NULL
+);
+"""
+
+_DATA_TABLES = ('artists', 'artist_aliases', 'artist_canonical', 'albums', 'tracks', 'skipped_tracks')
+
+
+def _unless_same(value, norm_title):
+    """Return None for a derived title that equals the normalized title."""
+    return None if value == norm_title else value
+
+
+def _track_canonical_keys(library_index):
+    """Map track rating keys to their canonical_index keys, space-separated (the keys have no spaces).
+
+    The keys are read back from the index rather than recomputed.
+    """
+    track_keys = {}
+    for canonical_key, records in library_index.canonical_index.items():
+        for record in records:
+            other_keys = track_keys.get(record.rating_key)
+            track_keys[record.rating_key] = f'{other_keys} {canonical_key}' if other_keys else canonical_key
+    return track_keys
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Keep the cyclic garbage collector out of a load, which creates many objects but no cycles.
+
+    The loaded index lives for the rest of the run, so its objects are then
+    frozen (see gc.freeze()) rather than left for later collections to walk.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.freeze()
+        if enabled:
+            gc.enable()
+
+
+def _connect(path):
+    """Open a snapshot database, recreating it if the schema version differs."""
+    conn = sqlite3.connect(path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version != SCHEMA_VERSION:
+        for table in ('snapshots',) + _DATA_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.executescript(_SCHEMA)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    return conn
+
+
+def _schema_matches(path):
+    """Check the schema version of an existing snapshot file without modifying it."""
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    finally:
+        conn.close()
+
+
+def save_snapshot(library_index, path):
+    """Write the index of one library section to a snapshot file."""
+    machine_id = library_index.machine_identifier or ''
+    section_key = str(library_index.section_key)
+    
+    conn = _connect(path)
+    try:
+        with conn:
+            row = conn.execute("SELECT id FROM snapshots WHERE machine_identifier = ? AND section_key = ?",
+                               (machine_id, section_key)).fetchone()
+            if row:
+                snapshot_id = row[0]
+                for table in _DATA_TABLES:
+                    conn.execute(f"DELETE FROM {table} WHERE snapshot_id = ?", (snapshot_id,))
+                conn.execute("UPDATE snapshots SET created_at = ?, last_updated = ?, index_paths = ? WHERE id = ?",
+                             (time.time(), library_index.last_updated, library_index.index_paths, snapshot_id))
+            else:
+                snapshot_id = conn.execute(
+                    "INSERT INTO snapshots (machine_identifier, section_key, created_at, last_updated, index_paths) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (machine_id, section_key, time.time(), library_index.last_updated,
+                     library_index.index_paths)).lastrowid
+            
+            conn.executemany("INSERT INTO artists VALUES (?, ?, ?, ?)",
+                             ((snapshot_id, artist.rating_key, artist.title, artist.norm_title)
+                              for artist in library_index.artists.values()))
+            conn.executemany("INSERT INTO artist_aliases VALUES (?, ?, ?)",
+                             ((snapshot_id, alias, canonical)
+                              for alias, canonical in library_index.artist_aliases.items()))
+            conn.executemany("INSERT INTO artist_canonical VALUES (?, ?, ?)",
+                             ((snapshot_id, canonical_key, norm_name)
+                              for canonical_key, norm_name in library_index.artist_canonical.items()))
+            conn.executemany("INSERT INTO albums VALUES (?, ?, ?, ?)",
+                             ((snapshot_id, album.rating_key, album.title, album.norm_title)
+                              for album in library_index.albums.values()))
+            # Derived titles are stored as NULL when they equal the normalized title
+            canonical_keys = _track_canonical_keys(library_index)
+            conn.executemany("INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             ((snapshot_id, track.rating_key, track.title, track.norm_title,
+                               _unless_same(track.base_title, track.norm_title),
+                               _unless_same(track.clean_title, track.norm_title),
+                               track.artist_key, track.album_key, track.duration, track.path_key,
+                               canonical_keys.get(track.rating_key, ''))
+                              for track in library_index.tracks.values()))
+            conn.executemany("INSERT INTO skipped_tracks VALUES (?, ?)",
+                             ((snapshot_id, rating_key) for rating_key in library_index.skipped_tracks))
+        print(f"Library index snapshot saved to: {path}")
+        return True
+    except Exception as e:
+        print(f"Error saving library index snapshot: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def load_snapshot(library_index, path):
+    """Fill the index from a snapshot file. Returns False if no usable snapshot exists."""
+    if not os.path.isfile(path):
+        return False
+    
+    machine_id = library_index.machine_identifier or ''
+    section_key = str(library_index.section_key)
+    
+    try:
+        if not _schema_matches(path):
+            print("Library index snapshot has an outdated format, rebuilding")
+            return False
+        
+        with contextlib.closing(sqlite3.connect(path)) as conn, _gc_paused():
+            row = conn.execute("SELECT id, last_updated, index_paths FROM snapshots "
+                               "WHERE machine_identifier = ? AND section_key = ?",
+                               (machine_id, section_key)).fetchone()
+            if not row:
+                return False
+            snapshot_id, library_index.last_updated, index_paths = row
+            library_index.index_paths = bool(index_paths)
+            
+            for rating_key, title, norm_name in conn.execute(
+                    "SELECT rating_key, title, norm_title FROM artists "
+                    "WHERE snapshot_id = ? ORDER BY rowid", (snapshot_id,)):
+                artist = ArtistRecord(rating_key, title, norm_name)
+                library_index.artists[rating_key] = artist
+                library_index.artist_index[norm_name] = artist
+            
+            for alias, canonical in conn.execute(
+                    "SELECT alias, canonical FROM artist_aliases "
+                    "WHERE snapshot_id = ? ORDER BY rowid", (snapshot_id,)):
+                library_index.artist_aliases[alias] = canonical
+            
+            for canonical_key, norm_name in conn.execute(
+                    "SELECT canonical_key, norm_title FROM artist_canonical "
+                    "WHERE snapshot_id = ? ORDER BY rowid", (snapshot_id,)):
+                library_index.artist_canonical[canonical_key] = norm_name
+            
+            for rating_key, title, norm_title in conn.execute(
+                    "SELECT rating_key, title, norm_title FROM albums WHERE snapshot_id = ?", (snapshot_id,)):
+                library_index.albums[rating_key] = AlbumRecord(rating_key, title, norm_title)
+            
+            rows = conn.execute(
+                "SELECT rating_key, title, norm_title, base_title, clean_title, artist_key, album_key, duration, "
+                "path_key, canonical_keys FROM tracks WHERE snapshot_id = ? ORDER BY rowid", (snapshot_id,)).fetchall()
+            library_index._add_tracks(
+                [TrackRecord(rating_key, title, norm_title, artist_key, album_key, duration,
+                             base_title=norm_title if base_title is None else base_title,
+                             clean_title=norm_title if clean_title is None else clean_title,
+                             path_key=path_key)
+                 for (rating_key, title, norm_title, base_title, clean_title,
+                      artist_key, album_key, duration, path_key, _) in rows],
+                [row[9].split() for row in rows])
+            
+            for (rating_key,) in conn.execute(
+                    "SELECT rating_key FROM skipped_tracks WHERE snapshot_id = ?", (snapshot_id,)):
+                library_index.skipped_tracks.add(rating_key)
+    except Exception as e:
+        print(f"Error loading library index snapshot: {e}")
+        for table in (library_index.artist_index, library_index.artist_aliases, library_index.track_index,
+                      library_index.artists, library_index.albums, library_index.tracks, library_index.path_index,
+                      library_index.artist_tracks, library_index.clean_title_index,
+                      library_index.artist_canonical, library_index.canonical_index, library_index.skipped_tracks):
+            table.clear()
+        return False
+    
+    return True
@@ -2,7 +2,36 @@ import re
 import time
 from collections import defaultdict
 
-from .string_utils import normalize_string, get_multi_similarity, clean_title_for_search
+import numpy as np
+from plexapi import utils
+
+from .string_utils import (normalize_string, get_multi_similarity, get_length_bound, clean_title_for_search,
+                           score_many, score_matrix, get_path_key, get_canonical_key)
+from .ngram_index import NgramIndex
+from .index_records import ArtistRecord, AlbumRecord, TrackRecord
+from .index_snapshot import save_snapshot, load_snapshot
+from .plex_requests import DEFAULT_CONCURRENCY, RequestBudgetExceeded, RequestStats, ordered_map, use_connection_pool
+
+# Number of tracks requested per page when bulk-building the index
+DEFAULT_PAGE_SIZE = 1000
+
+# Number of matched tracks fetched from Plex per request
+FETCH_BATCH_SIZE = 200
+
+# Times the per-artist build retries artists whose albums failed to load
+ARTIST_RETRY_ROUNDS = 2
+
+# Stand-in for the artist of a track whose artist has left the index
+UNKNOWN_ARTIST = ArtistRecord(0, '')
+
+# Number of nearest titles (by shared trigrams) scored in the fuzzy tiers of find_track
+FUZZY_CANDIDATES = 50
+
+# Titles that go through the featured-artist tier of find_track ("with" only as a whole word)
+FEATURED_PATTERN = re.compile(r'feat\.|\bwith\b')
+
+# Seconds a track's duration may differ from a playlist entry's #EXTINF duration in find_track
+DURATION_TOLERANCE = 10
 
 class PlexLibraryIndex:
     """Index a Plex library for faster and smarter searching."""
@@ -10,67 +39,576 @@ class PlexLibraryIndex:
     def __init__(self, plex):
         """Initialize the index with a PlexServer instance."""
         self.plex = plex
-        self.artist_index = {}  # Maps normalized artist name to artist object
+        self.artist_index = {}  # Maps normalized artist name to artist record
         self.artist_aliases = {}  # Maps aliases to canonical artist names
-        self.track_index = defaultdict(list)  # Maps normalized track title to list of track objects
+        self.artist_canonical = {}  # Maps get_canonical_key() of artist names to the normalized name
+        self.track_index = defaultdict(list)  # Maps normalized track title to list of track records
+        self.artists = {}  # Maps rating key to artist record
+        self.albums = {}  # Maps rating key to album record
+        self.tracks = {}  # Maps rating key to track record
+        self.skipped_tracks = set()  # Rating keys of tracks in Plex that aren't indexed, e.g. without a known artist
+        self.artist_tracks = defaultdict(list)  # Maps artist rating key to its track records
+        self.title_ngrams = None  # Trigram index over track_index keys, built on first fuzzy lookup
+        self.clean_title_index = defaultdict(list)  # Maps normalized search-cleaned title to track records
+        self.canonical_index = defaultdict(list)  # Maps get_canonical_key() of track titles to track records
+        self.clean_title_ngrams = None  # Trigram index over clean_title_index keys, built on first featured lookup
+        self.artist_ngrams = None  # Trigram index over artist_index keys, built on first fuzzy lookup
+        self.artist_cache = {}  # Maps (normalized name, threshold) to the fuzzy find_artist result
+        self.index_paths = False  # Whether tracks carry the path key of their media file
+        self.path_index = {}  # Maps media file path key to track record; None when several tracks share it
+        self.duration_tolerance = DURATION_TOLERANCE  # Seconds; 0 or None turns the duration window off
+        self.concurrency = DEFAULT_CONCURRENCY  # Plex requests in flight while building or refreshing
+        self.build_rate = None  # Pages (or artists) per second so far, when build_index() reports progress
+        self.machine_identifier = None
+        self.section_key = None
+        self.last_updated = None  # Newest addedAt/updatedAt (epoch seconds) seen in the library
         self.initialized = False
     
-    def build_index(self, music_library=None, callback=None):
-        """Build the library index. This may take time for large libraries."""
-        start_time = time.time()
-        print("Building Plex library index...")
-        
+    def __getstate__(self):
+        """Pickle the index without its Plex connection, e.g. for worker processes."""
+        state = self.__dict__.copy()
+        state['plex'] = None
+        return state
+    
+    def _get_music_library(self, music_library=None):
+        """Return the given music section, or the first one on the server."""
         if music_library is None:
             music_sections = [section for section in self.plex.library.sections() 
                              if section.type == 'artist']
             if not music_sections:
                 print("No music library found in Plex!")
-                return False
+                return None
             music_library = music_sections[0]
         
+        self.machine_identifier = self.plex.machineIdentifier
+        self.section_key = music_library.key
+        return music_library
+    
+    def build_index(self, music_library=None, callback=None, bulk=True, page_size=DEFAULT_PAGE_SIZE,
+                    index_paths=True, concurrency=DEFAULT_CONCURRENCY):
+        """Build the library index. This may take time for large libraries.
+
+        By default every track is pulled in pages of ``page_size`` from a single
+        section-level listing and attached to its artist and album locally. Pass
+        ``bulk=False`` to walk each artist's albums and tracks instead.
+        ``callback(done, total)`` receives progress in pages (or artists); the
+        pages (or artists) per second so far are in ``build_rate`` when it is
+        called. With ``index_paths`` the last components of each track's media
+        file path are indexed too, so playlist entries pointing at the same
+        files match without any similarity scoring (see find_by_path()).
+
+        Up to ``concurrency`` requests (pages, or artists) are in flight at
+        once over the connection's keep-alive pool. Results are applied in
+        listing order, so the index is the same as with ``concurrency=1``.
+        A summary of request counts, bytes and latencies is printed.
+        """
+        start_time = time.time()
+        print("Building Plex library index...")
+        
+        music_library = self._get_music_library(music_library)
+        if music_library is None:
+            return False
+        
+        self.index_paths = index_paths
+        self.concurrency = concurrency
+        use_connection_pool(self.plex, concurrency)
+        
+        request_stats = RequestStats()
+        with request_stats.observe(self.plex):
+            if bulk:
+                self._build_index_bulk(music_library, callback, page_size)
+            else:
+                self._build_index_per_artist(music_library, callback)
+        
+        elapsed = time.time() - start_time
+        print(f"Library index built in {elapsed:.2f} seconds")
+        print(request_stats.summary())
+        print(f"Indexed {len(self.artist_index)} artists and {len(self.track_index)} unique track titles")
+        if self.index_paths:
+            print(f"Indexed {len(self.path_index)} media file paths")
+        
+        self.initialized = True
+        return True
+    
+    def save_snapshot(self, path):
+        """Save the built index to an on-disk snapshot."""
+        if not self.initialized:
+            print("Library index not initialized. Call build_index() first.")
+            return False
+        return save_snapshot(self, path)
+    
+    def load_snapshot(self, path, music_library=None):
+        """Load the index from an on-disk snapshot instead of building it.
+
+        Returns False when there is no snapshot for this server and section,
+        or it was written with an older schema.
+        """
+        start_time = time.time()
+        music_library = self._get_music_library(music_library)
+        if music_library is None or not load_snapshot(self, path):
+            return False
+        
+        elapsed = time.time() - start_time
+        print(f"Library index loaded from snapshot in {elapsed:.2f} seconds")
+        print(f"Indexed {len(self.artist_index)} artists and {len(self.track_index)} unique track titles")
+        
+        self.initialized = True
+        return True
+    
+    def fetch_tracks(self, records, batch_size=FETCH_BATCH_SIZE):
+        """Fetch the Plex Track objects for track records, in batches, keeping their order."""
+        rating_keys = list(dict.fromkeys(record.rating_key for record in records))
+        fetched = {}
+        
+        for i in range(0, len(rating_keys), batch_size):
+            batch = rating_keys[i:i + batch_size]
+            for track in self.plex.fetchItems(batch, container_size=batch_size):
+                fetched[track.ratingKey] = track
+        
+        missing = [record for record in records if record.rating_key not in fetched]
+        if missing:
+            print(f"Warning: {len(missing)} matched tracks no longer exist in Plex")
+        
+        return [fetched[record.rating_key] for record in records if record.rating_key in fetched]
+    
+    def _build_index_bulk(self, music_library, callback=None, page_size=DEFAULT_PAGE_SIZE):
+        """Index all tracks from paged section-level listings."""
+        for attrs in self._query_items(self._section_path(music_library, 'artist'), page_size):
+            self._add_artist(ArtistRecord(int(attrs['ratingKey']), attrs.get('title', '')))
+            self._note_updated(attrs)
+        
+        for attrs in self._query_items(self._section_path(music_library, 'album'), page_size):
+            self.albums[int(attrs['ratingKey'])] = AlbumRecord(int(attrs['ratingKey']), attrs.get('title', ''))
+            self._note_updated(attrs)
+        
+        page_start = time.time()
+        
+        for page, total_pages, items in self._query_pages(self._section_path(music_library, 'track'), page_size):
+            for attrs in items:
+                record = self._make_track_record(attrs)
+                if record.artist_key not in self.artists:
+                    self.skipped_tracks.add(record.rating_key)
+                    continue
+                self._add_track(record)
+                self._note_updated(attrs)
+            
+            if callback:
+                self.build_rate = page / max(time.time() - page_start, 1e-6)
+                callback(page, total_pages)
+        
+        if self.skipped_tracks:
+            print(f"Skipped {len(self.skipped_tracks)} tracks without a matching artist")
+    
+    def _build_index_per_artist(self, music_library, callback=None):
+        """Index tracks by walking every artist's albums, fetching several artists at a time.
+
+        Artists whose albums can't be fetched are retried one at a time
+        after the pass, up to ARTIST_RETRY_ROUNDS times, and reported if
+        they still fail. Their tracks' rating keys are unknown then, so the
+        next refresh_index() scans for them and records them as skipped.
+        """
         all_artists = music_library.all()
         total_artists = len(all_artists)
+        start = time.time()
+        failed = []
         
-        for i, artist in enumerate(all_artists):
+        for i, (artist, (albums, error)) in enumerate(zip(all_artists, ordered_map(self._fetch_artist_albums,
+                                                                                   all_artists, self.concurrency))):
             if callback and i % 10 == 0:
+                self.build_rate = i / max(time.time() - start, 1e-6)
                 callback(i, total_artists)
-                
-            norm_name = normalize_string(artist.title)
-            self.artist_index[norm_name] = artist
             
-            variations = self._get_artist_variations(artist.title)
-            for variation in variations:
-                norm_var = normalize_string(variation)
-                if norm_var and norm_var != norm_name:
-                    self.artist_aliases[norm_var] = norm_name
+            self._add_artist(ArtistRecord(artist.ratingKey, artist.title))
+            self._note_updated(artist)
             
-            try:
-                for album in artist.albums():
-                    for track in album.tracks():
-                        norm_title = normalize_string(track.title)
-                        self.track_index[norm_title].append({
-                            'track': track,
-                            'artist': artist,
-                            'album': album
-                        })
-                        
-                        base_title = re.sub(r'\s*\(.*?\)', '', norm_title).strip()
-                        if base_title and base_title != norm_title:
-                            self.track_index[base_title].append({
-                                'track': track,
-                                'artist': artist,
-                                'album': album
-                            })
-            except Exception as e:
-                print(f"Error indexing tracks for {artist.title}: {e}")
+            if error is None:
+                self._add_artist_albums(artist, albums)
+            else:
+                print(f"Error indexing tracks for {artist.title}: {error} (will retry)")
+                failed.append(artist)
+        
+        for retry_round in range(1, ARTIST_RETRY_ROUNDS + 1):
+            if not failed:
+                break
+            print(f"Retrying {len(failed)} artists (round {retry_round} of {ARTIST_RETRY_ROUNDS})")
+            retry, failed = failed, []
+            for artist in retry:
+                albums, error = self._fetch_artist_albums(artist)
+                if error is None:
+                    self._add_artist_albums(artist, albums)
+                else:
+                    failed.append(artist)
+        
+        if failed:
+            print(f"Warning: could not index the tracks of {len(failed)} artists: "
+                  f"{', '.join(artist.title for artist in failed)}")
+    
+    def _fetch_artist_albums(self, artist):
+        """Fetch an artist's albums with their tracks; return ([(album, tracks)], None) or ([], error)."""
+        try:
+            return [(album, album.tracks()) for album in artist.albums()], None
+        except RequestBudgetExceeded:
+            raise
+        except Exception as e:
+            return [], e
+    
+    def _add_artist_albums(self, artist, albums):
+        """Index the fetched albums and tracks of an artist."""
+        for album, tracks in albums:
+            self.albums[album.ratingKey] = AlbumRecord(album.ratingKey, album.title)
+            self._note_updated(album)
+            for track in tracks:
+                path_key = get_path_key(track.locations[0]) if self.index_paths and track.locations else None
+                self._add_track(TrackRecord(track.ratingKey, track.title, normalize_string(track.title),
+                                            artist.ratingKey, album.ratingKey, track.duration,
+                                            path_key=path_key))
+                self._note_updated(track)
+    
+    def refresh_index(self, music_library=None, concurrency=DEFAULT_CONCURRENCY):
+        """Patch the index with items added, updated or removed since it was built.
+
+        Only items whose updatedAt is at or after the second of the last seen
+        change are fetched; the ones already seen then are recognized and
+        skipped. Removals are detected by comparing item counts, including
+        the tracks left out of the index (skipped_tracks), so the full list
+        of rating keys is only scanned when something was deleted.
+        Returns a dict with 'added', 'updated' and 'removed' track counts,
+        the watermark the refresh started from as 'since', and as 'changed'
+        the track and artist records it added, changed or removed (old and
+        new versions; tracks of renamed artists and albums included).
+        Listings are paged with up to ``concurrency`` requests in flight.
+        """
+        if not self.initialized or self.last_updated is None:
+            print("Library index has no change watermark. Call build_index() first.")
+            return None
+        
+        start_time = time.time()
+        music_library = self._get_music_library(music_library)
+        if music_library is None:
+            return None
+        
+        self.concurrency = concurrency
+        use_connection_pool(self.plex, concurrency)
+        request_stats = RequestStats()
+        with request_stats.observe(self.plex):
+            stats = self._apply_changes(music_library)
         
         elapsed = time.time() - start_time
-        print(f"Library index built in {elapsed:.2f} seconds")
-        print(f"Indexed {len(self.artist_index)} artists and {len(self.track_index)} unique track titles")
+        print(f"Library index refreshed in {elapsed:.2f} seconds: "
+              f"{stats['added']} added, {stats['updated']} updated, {stats['removed']} removed")
+        print(request_stats.summary())
+        return stats
+    
+    def _apply_changes(self, music_library):
+        """Fetch the changes since the watermark and apply them; return refresh_index()'s result."""
+        since = self.last_updated
+        changed = []
+        stats = {'added': 0, 'updated': 0, 'removed': 0, 'since': since, 'changed': changed}
         
-        self.initialized = True
+        for attrs in self._query_items(self._section_path(music_library, 'artist', since)):
+            rating_key = int(attrs['ratingKey'])
+            known = self.artists.get(rating_key)
+            if known is None or known.title != attrs.get('title', ''):
+                if known is not None:
+                    changed.append(known)
+                    changed.extend(self.artist_tracks.get(rating_key, ()))
+                self._remove_artist(rating_key)
+                self._add_artist(ArtistRecord(rating_key, attrs.get('title', '')))
+                changed.append(self.artists[rating_key])
+            self._note_updated(attrs)
+        
+        renamed_albums = set()
+        for attrs in self._query_items(self._section_path(music_library, 'album', since)):
+            rating_key = int(attrs['ratingKey'])
+            known = self.albums.get(rating_key)
+            if known is None or known.title != attrs.get('title', ''):
+                if known is not None:
+                    renamed_albums.add(rating_key)
+                self.albums[rating_key] = AlbumRecord(rating_key, attrs.get('title', ''))
+            self._note_updated(attrs)
+        if renamed_albums:
+            changed.extend(record for record in self.tracks.values() if record.album_key in renamed_albums)
+        
+        for attrs in self._query_items(self._section_path(music_library, 'track', since)):
+            record = self._make_track_record(attrs)
+            self._note_updated(attrs)
+            if record.artist_key not in self.artists:
+                if record.rating_key not in self.tracks:
+                    self.skipped_tracks.add(record.rating_key)
+                continue
+            self.skipped_tracks.discard(record.rating_key)
+            
+            known = self.tracks.get(record.rating_key)
+            if known is not None and known.same_as(record):
+                continue  # Seen at the watermark, nothing changed
+            
+            if known is not None:
+                changed.append(known)
+            if self._remove_track(record.rating_key):
+                stats['updated'] += 1
+            else:
+                stats['added'] += 1
+            self._add_track(record)
+            changed.append(record)
+        
+        # Counts only differ from ours when something was deleted in Plex
+        if music_library.totalViewSize(libtype='artist', includeCollections=False) != len(self.artists):
+            current = self._fetch_rating_keys(music_library, 'artist')
+            for rating_key in [key for key in self.artists if key not in current]:
+                changed.append(self.artists[rating_key])
+                self._remove_artist(rating_key)
+        
+        if (music_library.totalViewSize(libtype='track', includeCollections=False)
+                != len(self.tracks) + len(self.skipped_tracks)):
+            current = self._fetch_rating_keys(music_library, 'track')
+            for rating_key in [key for key in self.tracks if key not in current]:
+                changed.append(self.tracks[rating_key])
+                self._remove_track(rating_key)
+                stats['removed'] += 1
+            # Whatever Plex lists that the index doesn't hold is skipped, so the counts match next time
+            self.skipped_tracks = current - self.tracks.keys()
+        
+        return stats
+    
+    def _section_path(self, music_library, libtype, updated_since=None):
+        """Return the listing path of one item type of a section, or of its items updated since a time."""
+        path = f"/library/sections/{music_library.key}/all?type={utils.searchType(libtype)}"
+        if updated_since is not None:
+            # Plex's >> is strictly after; items changed in the watermark's own second are wanted too
+            path += f"&updatedAt>>={updated_since - 1}"
+        return path
+    
+    def _query_page(self, path, start, size):
+        """Fetch one page of a listing as raw XML attributes, skipping plexapi object construction."""
+        data = self.plex.query(path, headers={'X-Plex-Container-Start': str(start),
+                                              'X-Plex-Container-Size': str(size)})
+        total = int(data.attrib.get('totalSize') or data.attrib.get('size') or 0)
+        
+        items = []
+        for elem in data:
+            if 'ratingKey' not in elem.attrib:
+                continue
+            part = elem.find('Media/Part')
+            if part is not None and 'file' in part.attrib:
+                elem.attrib['partFile'] = part.attrib['file']
+            items.append(elem.attrib)
+        return items, total
+    
+    def _query_pages(self, path, page_size=DEFAULT_PAGE_SIZE):
+        """Yield (page number, page count, items) for every page of a listing, in order.
+
+        The first page tells how many there are; the others are then fetched
+        with up to ``self.concurrency`` requests in flight.
+        """
+        items, total = self._query_page(path, 0, page_size)
+        total_pages = max(1, -(-total // page_size))
+        yield 1, total_pages, items
+        if not items:
+            return
+        
+        starts = range(page_size, total_pages * page_size, page_size)
+        pages = ordered_map(lambda start: self._query_page(path, start, page_size)[0], starts, self.concurrency)
+        for page, items in enumerate(pages, 2):
+            yield page, total_pages, items
+    
+    def _query_items(self, path, page_size=DEFAULT_PAGE_SIZE):
+        """Yield the raw XML attributes of every item of a listing."""
+        for _, _, items in self._query_pages(path, page_size):
+            yield from items
+    
+    def _fetch_rating_keys(self, music_library, libtype):
+        """Fetch the set of rating keys of an item type in a section."""
+        return {int(attrs['ratingKey'])
+                for attrs in self._query_items(self._section_path(music_library, libtype), DEFAULT_PAGE_SIZE * 10)}
+    
+    def _make_track_record(self, attrs):
+        """Create a track record from the XML attributes of a track."""
+        title = attrs.get('title', '')
+        album_key = attrs.get('parentRatingKey')
+        duration = attrs.get('duration')
+        return TrackRecord(int(attrs['ratingKey']), title, normalize_string(title),
+                           int(attrs.get('grandparentRatingKey') or 0),
+                           int(album_key) if album_key else None,
+                           int(duration) if duration else None,
+                           path_key=get_path_key(attrs.get('partFile')) if self.index_paths else None)
+    
+    def _note_updated(self, item):
+        """Advance the change watermark used by refresh_index()."""
+        if isinstance(item, dict):
+            changed_at = item.get('updatedAt') or item.get('addedAt')
+            stamp = int(changed_at) if changed_at else None
+        else:
+            changed_at = item.updatedAt or item.addedAt
+            stamp = int(changed_at.timestamp()) if changed_at is not None else None
+        
+        if stamp is not None and (self.last_updated is None or stamp > self.last_updated):
+            self.last_updated = stamp
+    
+    def _add_artist(self, artist):
+        """Register an artist record and its name variations."""
+        self.artists[artist.rating_key] = artist
+        norm_name = artist.norm_title
+        self.artist_index[norm_name] = artist
+        self.artist_cache.clear()
+        if self.artist_ngrams is not None:
+            self.artist_ngrams.add(norm_name)
+        
+        variations = self._get_artist_variations(artist.title)
+        for variation in variations:
+            norm_var = normalize_string(variation)
+            if norm_var and norm_var != norm_name:
+                self.artist_aliases[norm_var] = norm_name
+        
+        self._add_artist_canonical(norm_name)
+    
+    def _add_artist_canonical(self, norm_name):
+        """Register the canonical key of an artist name; the first artist with a key keeps it."""
+        canonical_key = get_canonical_key(norm_name)
+        if canonical_key:
+            self.artist_canonical.setdefault(canonical_key, norm_name)
+    
+    def _remove_artist(self, rating_key):
+        """Drop an artist and the aliases pointing at it."""
+        artist = self.artists.pop(rating_key, None)
+        if artist is None:
+            return False
+        
+        self.artist_cache.clear()
+        norm_name = artist.norm_title
+        if self.artist_index.get(norm_name) is artist:
+            del self.artist_index[norm_name]
+            for variation in self._get_artist_variations(artist.title):
+                norm_var = normalize_string(variation)
+                if self.artist_aliases.get(norm_var) == norm_name:
+                    del self.artist_aliases[norm_var]
+            canonical_key = get_canonical_key(norm_name)
+            if self.artist_canonical.get(canonical_key) == norm_name:
+                del self.artist_canonical[canonical_key]
+        return True
+    
+    def _add_track(self, record):
+        """Register a track record under its normalized title and base title, its artist and its path key."""
+        self.tracks[record.rating_key] = record
+        self.artist_tracks[record.artist_key].append(record)
+        for key in self._track_keys(record):
+            if key not in self.track_index and self.title_ngrams is not None:
+                self.title_ngrams.add(key)
+            self.track_index[key].append(record)
+        
+        if record.clean_title not in self.clean_title_index and self.clean_title_ngrams is not None:
+            self.clean_title_ngrams.add(record.clean_title)
+        self.clean_title_index[record.clean_title].append(record)
+        
+        for canonical_key in self._canonical_keys(record):
+            self.canonical_index[canonical_key].append(record)
+        
+        if record.path_key:
+            # Files that share their last path components can't be told apart
+            self.path_index[record.path_key] = None if record.path_key in self.path_index else record
+    
+    def _add_tracks(self, records, canonical_keys):
+        """Register many track records as _add_track() would, given each one's _canonical_keys().
+
+        This is the bulk path for filling an empty index from a snapshot: one
+        loop over the records with the maps bound to locals, and the trigram
+        indexes left to be built on first use.
+        """
+        tracks = self.tracks
+        artist_tracks = self.artist_tracks
+        track_index = self.track_index
+        clean_title_index = self.clean_title_index
+        canonical_index = self.canonical_index
+        path_index = self.path_index
+        
+        for record, keys in zip(records, canonical_keys):
+            tracks[record.rating_key] = record
+            artist_tracks[record.artist_key].append(record)
+            track_index[record.norm_title].append(record)
+            if record.base_title and record.base_title != record.norm_title:
+                track_index[record.base_title].append(record)
+            clean_title_index[record.clean_title].append(record)
+            for canonical_key in keys:
+                canonical_index[canonical_key].append(record)
+            if record.path_key:
+                path_index[record.path_key] = None if record.path_key in path_index else record
+        
+        self.title_ngrams = None
+        self.clean_title_ngrams = None
+    
+    def _remove_track(self, rating_key):
+        """Drop a track from every title it is indexed under."""
+        record = self.tracks.pop(rating_key, None)
+        if record is None:
+            return False
+        
+        for key in self._track_keys(record):
+            remaining = [other for other in self.track_index.get(key, ()) if other is not record]
+            if remaining:
+                self.track_index[key] = remaining
+            else:
+                self.track_index.pop(key, None)
+        
+        remaining = [other for other in self.clean_title_index.get(record.clean_title, ()) if other is not record]
+        if remaining:
+            self.clean_title_index[record.clean_title] = remaining
+        else:
+            self.clean_title_index.pop(record.clean_title, None)
+        
+        for canonical_key in self._canonical_keys(record):
+            remaining = [other for other in self.canonical_index.get(canonical_key, ()) if other is not record]
+            if remaining:
+                self.canonical_index[canonical_key] = remaining
+            else:
+                self.canonical_index.pop(canonical_key, None)
+        
+        remaining = [other for other in self.artist_tracks.get(record.artist_key, ()) if other is not record]
+        if remaining:
+            self.artist_tracks[record.artist_key] = remaining
+        else:
+            self.artist_tracks.pop(record.artist_key, None)
+        
+        if record.path_key and self.path_index.get(record.path_key) is record:
+            del self.path_index[record.path_key]
         return True
     
+    def _track_keys(self, record):
+        """Return the track_index keys of a track record: its normalized title and base title."""
+        if record.base_title and record.base_title != record.norm_title:
+            return [record.norm_title, record.base_title]
+        return [record.norm_title]
+    
+    def _canonical_keys(self, record):
+        """Return the canonical_index keys of a track record: those of its normalized, base and cleaned titles."""
+        keys = dict.fromkeys(get_canonical_key(title)
+                             for title in (record.norm_title, record.base_title, record.clean_title))
+        keys.pop('', None)
+        return list(keys)
+    
+    def _get_title_ngrams(self):
+        """Return the trigram index over track titles, building it on first use."""
+        if self.title_ngrams is None:
+            self.title_ngrams = NgramIndex()
+            for key in self.track_index:
+                self.title_ngrams.add(key)
+        return self.title_ngrams
+    
+    def _get_clean_title_ngrams(self):
+        """Return the trigram index over search-cleaned track titles, building it on first use."""
+        if self.clean_title_ngrams is None:
+            self.clean_title_ngrams = NgramIndex()
+            for clean_title in self.clean_title_index:
+                self.clean_title_ngrams.add(clean_title)
+        return self.clean_title_ngrams
+    
+    def _title_order(self, keys, ngrams=None):
+        """Sort indexed titles into the order they were added to a trigram index (the title index by default)."""
+        key_ids = (ngrams or self.title_ngrams).key_ids
+        return sorted(keys, key=lambda key: key_ids.get(key, len(key_ids)))
+    
+    def _track_names(self, record):
+        """Return the artist and album records of a track record."""
+        return self.artists.get(record.artist_key, UNKNOWN_ARTIST), self.albums.get(record.album_key)
+    
     def _get_artist_variations(self, artist_name):
         """Generate common variations of artist names."""
         variations = [artist_name]
@@ -90,6 +628,14 @@ class PlexLibraryIndex:
         
         return variations
     
+    def find_by_path(self, path):
+        """Find the track whose media file ends in the same components as a playlist path."""
+        if not self.path_index:
+            return None
+        
+        path_key = get_path_key(path)
+        return self.path_index.get(path_key) if path_key else None
+    
     def find_artist(self, artist_name, threshold=0.7):
         """Find an artist in the indexed library."""
         if not self.initialized:
@@ -105,166 +651,359 @@ class PlexLibraryIndex:
             canonical = self.artist_aliases[norm_name]
             return self.artist_index[canonical]
         
+        # Same words in another order, or without an article or "and"
+        canonical = self.artist_canonical.get(get_canonical_key(norm_name))
+        if canonical in self.artist_index:
+            return self.artist_index[canonical]
+        
+        cache_key = (norm_name, threshold)
+        if cache_key in self.artist_cache:
+            return self.artist_cache[cache_key]
+        
         best_match = None
         best_score = threshold
         
-        for indexed_name, artist in self.artist_index.items():
-            score = get_multi_similarity(norm_name, indexed_name)
+        candidates = [indexed_name
+                      for indexed_name in self._get_artist_ngrams().candidates(norm_name, FUZZY_CANDIDATES)
+                      if indexed_name in self.artist_index
+                      and get_length_bound(len(norm_name), len(indexed_name)) > threshold]
+        scores = score_many(norm_name, candidates, normalized=True, score_cutoff=threshold).tolist()
+        for indexed_name, score in zip(candidates, scores):
             if score > best_score:
                 best_score = score
-                best_match = artist
+                best_match = self.artist_index[indexed_name]
         
+        self.artist_cache[cache_key] = best_match
         return best_match
     
-    def find_track(self, artist_name, track_title, album_title=None):
-        """Find a track in the indexed library."""
+    def _get_artist_ngrams(self):
+        """Return the trigram index over artist names, building it on first use."""
+        if self.artist_ngrams is None:
+            self.artist_ngrams = NgramIndex()
+            for norm_name in self.artist_index:
+                self.artist_ngrams.add(norm_name)
+        return self.artist_ngrams
+    
+    def _artist_sims(self, norm_artist, records, score_cutoff):
+        """Score an artist name against the artists of track records, one batch per distinct name."""
+        names = [self._track_names(record)[0].norm_title for record in records]
+        unique_names = list(dict.fromkeys(names))
+        sims = score_many(norm_artist, unique_names, normalized=True, score_cutoff=score_cutoff).tolist()
+        sims = dict(zip(unique_names, sims))
+        return [sims[name] for name in names]
+    
+    def _duration_filter(self, duration):
+        """Return a predicate keeping track records whose duration is near ``duration`` seconds.
+
+        Returns None when there is nothing to filter on. Records without a
+        known duration always pass.
+        """
+        if not duration or not self.duration_tolerance:
+            return None
+        
+        low = (duration - self.duration_tolerance) * 1000
+        high = (duration + self.duration_tolerance) * 1000
+        return lambda record: record.duration is None or low <= record.duration <= high
+    
+    def _fitting_records(self, indexed_title, fits, index=None):
+        """Return the records indexed under a title (in track_index by default) that pass a duration filter."""
+        records = (self.track_index if index is None else index).get(indexed_title, ())
+        return records if fits is None else [record for record in records if fits(record)]
+    
+    def find_track(self, artist_name, track_title, album_title=None, duration=None):
+        """Find a track in the indexed library.
+
+        With a ``duration`` in seconds (from #EXTINF) candidates whose length
+        differs by more than ``duration_tolerance`` seconds are dropped
+        before any scoring.
+        """
+        return self.find_track_variants(artist_name, [track_title], album_title, duration)
+    
+    def find_track_variants(self, artist_name, track_titles, album_title=None, duration=None):
+        """Find a track under any of several spellings of its title.
+
+        The artist is resolved once, and each tier scores all titles that
+        are still without matches in one batch. Every title falls through
+        the tiers on its own, as in separate find_track() calls. Each track
+        is returned once, with the best score any title gave it; earlier
+        titles win ties.
+        """
         if not self.initialized:
             print("Library index not initialized. Call build_index() first.")
             return []
         
-        clean_title = clean_title_for_search(track_title)
-        
-        norm_title = normalize_string(track_title)
-        clean_norm_title = normalize_string(clean_title)
+        fits = self._duration_filter(duration)
         norm_artist = normalize_string(artist_name)
         norm_album = normalize_string(album_title) if album_title else None
         
         artist = self.find_artist(artist_name, threshold=0.6)
         
-        matches = []
+        # (title, normalized title, normalized search title) of each distinct title
+        queries = [(track_title, normalize_string(track_title), normalize_string(clean_title_for_search(track_title)))
+                   for track_title in dict.fromkeys(track_titles)]
+        
+        found = {}  # Maps title to its matches
+        pending = queries
+        
+        pending = self._collect_matches(found, pending, self._exact_matches(pending, norm_artist, norm_album, fits))
+        
+        # Same title words in another order, or without an article, "and" or a featured artist
+        if pending:
+            pending = self._collect_matches(found, pending,
+                                            self._canonical_matches(pending, norm_artist, artist, norm_album, fits))
+        
+        # Special lookup for tracks with featured artists
+        featured = [query for query in pending if FEATURED_PATTERN.search(query[0])]
+        if featured:
+            pending = self._collect_matches(found, pending, self._featured_matches(featured, norm_artist, fits))
+        
+        # If we have a specific artist, search their tracks
+        if artist and pending:
+            pending = self._collect_matches(found, pending, self._artist_matches(pending, artist, norm_album, fits))
+        
+        # Fuzzy search through all tracks as last resort
+        if pending:
+            self._collect_matches(found, pending, self._fuzzy_matches(pending, norm_artist, norm_album, fits))
+        
+        best = {}  # Maps rating key to its best match
+        for track_title, _, _ in queries:
+            for match in found.get(track_title, ()):
+                rating_key = match['track'].rating_key
+                if rating_key not in best or match['score'] > best[rating_key]['score']:
+                    best[rating_key] = match
         
-        title_variants = [norm_title]
-        if clean_norm_title != norm_title:
-            title_variants.append(clean_norm_title)
+        return sorted(best.values(), key=lambda x: x['score'], reverse=True)
+    
+    def _collect_matches(self, found, queries, tier_matches):
+        """Store the matches a tier found per title; return the queries it found nothing for."""
+        for track_title, matches in tier_matches.items():
+            if matches:
+                found[track_title] = matches
+        return [query for query in queries if not found.get(query[0])]
+    
+    def _album_sims(self, norm_album):
+        """Return a function scoring an album record against ``norm_album``, once per album."""
+        sims = {}
+        
+        def album_sim(album):
+            if not norm_album or album is None:
+                return 0.0
+            if album.rating_key not in sims:
+                sims[album.rating_key] = get_multi_similarity(norm_album, album.norm_title, normalized=True)
+            return sims[album.rating_key]
+        
+        return album_sim
+    
+    def _exact_matches(self, queries, norm_artist, norm_album, fits):
+        """Tier 1: tracks indexed under the exact normalized (or search-cleaned) title."""
+        def title_keys(norm_title, clean_norm_title):
+            return [norm_title] if clean_norm_title == norm_title else [norm_title, clean_norm_title]
+        
+        return self._keyed_matches(queries, title_keys, self.track_index, 'exact', norm_artist, norm_album, fits)
+    
+    def _canonical_matches(self, queries, norm_artist, artist, norm_album, fits):
+        """Tier 2: tracks sharing the canonical key (see get_canonical_key()) of the title or search-cleaned title."""
+        def title_keys(norm_title, clean_norm_title):
+            return [key for key in dict.fromkeys((get_canonical_key(norm_title), get_canonical_key(clean_norm_title)))
+                    if key]
+        
+        # Reordered words can make another song's title, so the artist has to agree as in the featured tier
+        return self._keyed_matches(queries, title_keys, self.canonical_index, 'canonical',
+                                   norm_artist, norm_album, fits, min_artist_sim=0.7, artist=artist)
+    
+    def _keyed_matches(self, queries, title_keys, index, tier, norm_artist, norm_album, fits,
+                       min_artist_sim=None, artist=None):
+        """Match queries to the tracks an index holds under their title keys; the title counts as equal.
+
+        With ``min_artist_sim``, tracks are skipped unless they are by
+        ``artist`` (as resolved by find_artist()) or their artist similarity
+        is above it, so a query left without hits falls through to the next tier.
+        """
+        album_sim_of = self._album_sims(norm_album)
+        tier_matches = {}
+        
+        for track_title, norm_title, clean_norm_title in queries:
+            matches = tier_matches[track_title] = []
             
-        for title_var in title_variants:
-            if title_var in self.track_index:
-                direct_matches = self.track_index[title_var]
-                for match_info in direct_matches:
-                    track = match_info['track']
-                    track_artist = match_info['artist']
-                    
-                    artist_sim = get_multi_similarity(norm_artist, normalize_string(track_artist.title))
-                    title_sim = 1.0  # Direct title match
+            for title_var in title_keys(norm_title, clean_norm_title):
+                if title_var in index:
+                    direct_matches = self._fitting_records(title_var, fits, index)
+                    for record in direct_matches:
+                        track_artist, album = self._track_names(record)
+                        
+                        artist_sim = get_multi_similarity(norm_artist, track_artist.norm_title, normalized=True)
+                        if (min_artist_sim is not None and artist_sim <= min_artist_sim
+                                and (artist is None or record.artist_key != artist.rating_key)):
+                            continue
+                        title_sim = 1.0  # Direct title match
+                        
+                        album_sim = album_sim_of(album)
+                        
+                        score = (artist_sim * 0.4) + (title_sim * 0.6)
+                        if norm_album:
+                            score = (score * 0.8) + (album_sim * 0.2)
+                        
+                        matches.append({
+                            'track': record,
+                            'artist_name': track_artist.title,
+                            'album_name': album.title if album else None,
+                            'score': score,
+                            'artist_sim': artist_sim,
+                            'title_sim': title_sim,
+                            'album_sim': album_sim if norm_album else None,
+                            'tier': tier
+                        })
+        
+        return tier_matches
+    
+    def _featured_matches(self, queries, norm_artist, fits):
+        """Tier 3: tracks whose search-cleaned title is close to the query's, by a similar artist.
+
+        Cleaned titles are looked up in clean_title_index, which is filled
+        from the precomputed TrackRecord.clean_title, so no title is cleaned
+        per query.
+        """
+        clean_ngrams = self._get_clean_title_ngrams()
+        clean_index = self.clean_title_index
+        
+        query_candidates = []
+        for track_title, _, norm_clean_title in queries:
+            # Tracks cleaned to exactly the query's title, plus the nearest other cleaned titles
+            clean_candidates = clean_ngrams.candidates(norm_clean_title, FUZZY_CANDIDATES)
+            if norm_clean_title in clean_index and norm_clean_title not in clean_candidates:
+                clean_candidates = self._title_order(clean_candidates + [norm_clean_title], clean_ngrams)
+            clean_candidates = [clean_indexed for clean_indexed in clean_candidates
+                                if self._fitting_records(clean_indexed, fits, clean_index)]
+            
+            clean_sims = score_many(norm_clean_title, clean_candidates, normalized=True, score_cutoff=0.85)
+            query_candidates.append((track_title, [(indexed_sim, record)
+                                                   for clean_indexed, indexed_sim in zip(clean_candidates,
+                                                                                         clean_sims.tolist())
+                                                   if indexed_sim > 0.85
+                                                   for record in self._fitting_records(clean_indexed, fits,
+                                                                                       clean_index)]))
+        
+        # One batch of artist scores for the candidates of every query
+        records = [record for _, candidates in query_candidates for _, record in candidates]
+        artist_sims = dict(zip(map(id, records), self._artist_sims(norm_artist, records, 0.7)))
+        
+        tier_matches = {}
+        for track_title, candidates in query_candidates:
+            matches = tier_matches[track_title] = []
+            for indexed_sim, record in candidates:
+                artist_sim = artist_sims[id(record)]
+                if artist_sim > 0.7:
+                    track_artist, album = self._track_names(record)
+                    score = (artist_sim * 0.4) + (indexed_sim * 0.6)
                     
-                    album_sim = 0.0
-                    if norm_album and match_info['album']:
-                        album_sim = get_multi_similarity(norm_album, normalize_string(match_info['album'].title))
+                    matches.append({
+                        'track': record,
+                        'artist_name': track_artist.title,
+                        'album_name': album.title if album else None,
+                        'score': score,
+                        'artist_sim': artist_sim,
+                        'title_sim': indexed_sim,
+                        'album_sim': None,
+                        'tier': 'featured'
+                    })
+        
+        return tier_matches
+    
+    def _artist_matches(self, queries, artist, norm_album, fits):
+        """Tier 4: the found artist's own tracks with a similar title, scored from the index alone."""
+        records = [record for record in self.artist_tracks.get(artist.rating_key, ())
+                   if fits is None or fits(record)]
+        title_sims = np.maximum(
+            score_matrix([norm_title for _, norm_title, _ in queries], [record.norm_title for record in records],
+                         normalized=True, score_cutoff=0.7),
+            score_matrix([clean_norm_title for _, _, clean_norm_title in queries],
+                         [record.clean_title for record in records], normalized=True, score_cutoff=0.7)
+        )
+        album_sim_of = self._album_sims(norm_album)
+        
+        tier_matches = {}
+        for (track_title, _, _), row in zip(queries, title_sims.tolist()):
+            matches = tier_matches[track_title] = []
+            for record, best_title_sim in zip(records, row):
+                if best_title_sim > 0.7:
+                    album = self.albums.get(record.album_key)
+                    album_sim = album_sim_of(album)
                     
-                    score = (artist_sim * 0.4) + (title_sim * 0.6)
+                    score = (1.0 * 0.4) + (best_title_sim * 0.6)
                     if norm_album:
                         score = (score * 0.8) + (album_sim * 0.2)
                     
                     matches.append({
-                        'track': track,
-                        'artist_name': track_artist.title,
-                        'album_name': match_info['album'].title if match_info['album'] else None,
+                        'track': record,
+                        'artist_name': artist.title,
+                        'album_name': album.title if album else None,
                         'score': score,
-                        'artist_sim': artist_sim,
-                        'title_sim': title_sim,
-                        'album_sim': album_sim if norm_album else None
+                        'artist_sim': 1.0,
+                        'title_sim': best_title_sim,
+                        'album_sim': album_sim if norm_album else None,
+                        'tier': 'artist'
                     })
         
-        # Special lookup for tracks with featured artists
-        if not matches and ('feat.' in track_title or 'with' in track_title):
-            clean_title = clean_title_for_search(track_title)
-            
-            for indexed_title, track_infos in self.track_index.items():
-                clean_indexed = clean_title_for_search(indexed_title)
-                indexed_sim = get_multi_similarity(clean_title.lower(), clean_indexed.lower())
-                
-                if indexed_sim > 0.85:
-                    for track_info in track_infos:
-                        track = track_info['track']
-                        track_artist = track_info['artist']
-                        
-                        artist_sim = get_multi_similarity(norm_artist, normalize_string(track_artist.title))
-                        
-                        if artist_sim > 0.7:
-                            score = (artist_sim * 0.4) + (indexed_sim * 0.6)
-                            
-                            matches.append({
-                                'track': track,
-                                'artist_name': track_artist.title,
-                                'album_name': track_info['album'].title if track_info['album'] else None,
-                                'score': score,
-                                'artist_sim': artist_sim,
-                                'title_sim': indexed_sim,
-                                'album_sim': None
-                            })
-                            
-        # If we have a specific artist, search their tracks
-        if artist and not matches:
-            try:
-                for album in artist.albums():
-                    for track in album.tracks():
-                        norm_track_title = normalize_string(track.title)
-                        clean_track_title = normalize_string(clean_title_for_search(track.title))
-                        
-                        title_variants = [
-                            (norm_title, norm_track_title),
-                            (clean_norm_title, clean_track_title)
-                        ]
-                        
-                        best_title_sim = 0
-                        for src_title, target_title in title_variants:
-                            this_sim = get_multi_similarity(src_title, target_title)
-                            best_title_sim = max(best_title_sim, this_sim)
-                        
-                        if best_title_sim > 0.7:
-                            album_sim = 0.0
-                            if norm_album:
-                                album_sim = get_multi_similarity(norm_album, normalize_string(album.title))
-                            
-                            score = (1.0 * 0.4) + (best_title_sim * 0.6)
-                            if norm_album:
-                                score = (score * 0.8) + (album_sim * 0.2)
-                            
-                            matches.append({
-                                'track': track,
-                                'artist_name': artist.title,
-                                'album_name': album.title,
-                                'score': score,
-                                'artist_sim': 1.0,
-                                'title_sim': best_title_sim,
-                                'album_sim': album_sim if norm_album else None
-                            })
-            except Exception as e:
-                print(f"Error searching tracks for artist {artist.title}: {e}")
+        return tier_matches
+    
+    def _fuzzy_matches(self, queries, norm_artist, norm_album, fits):
+        """Tier 5: any track whose title is close to the query's, by a similar artist.
+
+        The nearest titles of all queries are pooled and scored against every
+        query in one matrix.
+        """
+        title_ngrams = self._get_title_ngrams()
+        candidates = set()
+        query_titles = []
+        query_rows = []  # Rows of query_titles belonging to each query
+        for _, norm_title, clean_norm_title in queries:
+            rows = [len(query_titles)]
+            query_titles.append(norm_title)
+            candidates.update(title_ngrams.candidates(norm_title, FUZZY_CANDIDATES))
+            if clean_norm_title != norm_title:
+                rows.append(len(query_titles))
+                query_titles.append(clean_norm_title)
+                candidates.update(title_ngrams.candidates(clean_norm_title, FUZZY_CANDIDATES))
+            query_rows.append(rows)
         
-        # Fuzzy search through all tracks as last resort
-        if not matches:
-            for indexed_title, track_infos in self.track_index.items():
-                title_sim = get_multi_similarity(norm_title, indexed_title)
-                clean_title_sim = get_multi_similarity(clean_norm_title, indexed_title)
-                
-                best_title_sim = max(title_sim, clean_title_sim)
-                
-                if best_title_sim > 0.8:
-                    for track_info in track_infos:
-                        track = track_info['track']
-                        track_artist = track_info['artist']
+        indexed_titles = [indexed_title for indexed_title in self._title_order(candidates)
+                          if self._fitting_records(indexed_title, fits)]
+        title_sims = score_matrix(query_titles, indexed_titles, normalized=True, score_cutoff=0.8)
+        best_title_sims = [title_sims[rows].max(axis=0).tolist() for rows in query_rows]
+        
+        # One batch of artist scores for every title close enough to at least one query
+        records = [record
+                   for indexed_title, close in zip(indexed_titles, np.any(title_sims > 0.8, axis=0).tolist())
+                   if close
+                   for record in self._fitting_records(indexed_title, fits)]
+        artist_sims = dict(zip(map(id, records), self._artist_sims(norm_artist, records, 0.6)))
+        album_sim_of = self._album_sims(norm_album)
+        
+        tier_matches = {}
+        for (track_title, _, _), sims in zip(queries, best_title_sims):
+            matches = tier_matches[track_title] = []
+            for indexed_title, best_title_sim in zip(indexed_titles, sims):
+                if best_title_sim <= 0.8:
+                    continue
+                for record in self._fitting_records(indexed_title, fits):
+                    artist_sim = artist_sims[id(record)]
+                    if artist_sim > 0.6:
+                        track_artist, album = self._track_names(record)
+                        album_sim = album_sim_of(album)
                         
-                        artist_sim = get_multi_similarity(norm_artist, normalize_string(track_artist.title))
+                        score = (artist_sim * 0.4) + (best_title_sim * 0.6)
+                        if norm_album:
+                            score = (score * 0.8) + (album_sim * 0.2)
                         
-                        if artist_sim > 0.6:
-                            album_sim = 0.0
-                            if norm_album and track_info['album']:
-                                album_sim = get_multi_similarity(norm_album, 
-                                                               normalize_string(track_info['album'].title))
-                            
-                            score = (artist_sim * 0.4) + (best_title_sim * 0.6)
-                            if norm_album:
-                                score = (score * 0.8) + (album_sim * 0.2)
-                            
-                            matches.append({
-                                'track': track,
-                                'artist_name': track_artist.title,
-                                'album_name': track_info['album'].title if track_info['album'] else None,
-                                'score': score,
-                                'artist_sim': artist_sim,
-                                'title_sim': best_title_sim,
-                                'album_sim': album_sim if norm_album else None
-                            })
-        
-        return sorted(matches, key=lambda x: x['score'], reverse=True)
\ No newline at end of file
+                        matches.append({
+                            'track': record,
+                            'artist_name': track_artist.title,
+                            'album_name': album.title if album else None,
+                            'score': score,
+                            'artist_sim': artist_sim,
+                            'title_sim': best_title_sim,
+                            'album_sim': album_sim if norm_album else None,
+                            'tier': 'fuzzy'
+                        })
+        
+        return tier_matches
\ No newline at end of file
@@ -0,0 +1,228 @@
+import os
+import sqlite3
+
+from .index_records import ArtistRecord
+from .string_utils import normalize_string, get_path_key, get_canonical_key
+
+# Bump whenever the stored layout or the matching rules behind cached results change
+CACHE_VERSION = 6
+
+_SCHEMA = """
+CREATE TABLE generation (
+    machine_identifier TEXT NOT NULL,
+    section_key TEXT NOT NULL,
+    last_updated INTEGER NOT NULL,
+    duration_tolerance INTEGER NOT NULL,
+    track_count INTEGER NOT NULL
+);
+CREATE TABLE matches (
+    artist TEXT NOT NULL,
+    title TEXT NOT NULL,
+    album TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    path_key TEXT NOT NULL,
+    threshold REAL NOT NULL,
+    rating_key INTEGER,
+    score REAL,
+    tier TEXT,
+    PRIMARY KEY (artist, title, album, duration, path_key, threshold)
+);
+"""
+
+class MatchCache:
+    """Persistent map from a normalized playlist query to the track it matched, for one library generation."""
+    
+    def __init__(self, path):
+        self.path = path
+        self.generation = None
+        self.track_count = 0  # Tracks in the index the entries were made with
+        self.entries = {}  # Maps query key to (rating key, score, match tier); all None for "no match"
+        self.hits = 0
+        self.misses = 0
+    
+    def load(self, library_index, refresh=None):
+        """Load the cached results that are still valid for the given index.
+
+        ``refresh`` is what refresh_index() returned for the index in this
+        run. If the cache was saved at the watermark that refresh started
+        from, only the entries its changes could affect are dropped;
+        otherwise a moved watermark drops the whole cache, and removed
+        tracks alone drop the cached misses.
+        """
+        self.generation = _library_generation(library_index)
+        self.track_count = len(library_index.tracks)
+        if self.generation is None or not os.path.isfile(self.path):
+            return
+        
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+                    print("Match cache has an outdated format, starting fresh")
+                    return
+                
+                row = conn.execute("SELECT machine_identifier, section_key, last_updated, duration_tolerance, "
+                                   "track_count FROM generation").fetchone()
+                if row is None or (row[0], row[1], row[3]) != (self.generation[0], self.generation[1],
+                                                               self.generation[3]):
+                    print("Library changed since the match cache was saved, starting fresh")
+                    return
+                
+                if row[2] == self.generation[2] and row[4] == self.track_count:
+                    is_stale = None
+                elif refresh is not None and refresh['since'] == row[2]:
+                    is_stale = _stale_filter(refresh['changed'], library_index)
+                elif row[2] == self.generation[2]:
+                    # Only removals: a removed near miss may let a query fall through to a later tier
+                    is_stale = lambda key, rating_key, tier: rating_key is None
+                else:
+                    print("Library changed since the match cache was saved, starting fresh")
+                    return
+                
+                dropped = 0
+                for artist, title, album, duration, path_key, threshold, rating_key, score, tier in conn.execute(
+                        "SELECT artist, title, album, duration, path_key, threshold, rating_key, score, tier "
+                        "FROM matches"):
+                    key = (artist, title, album, duration, path_key, threshold)
+                    if is_stale is not None and is_stale(key, rating_key, tier):
+                        dropped += 1
+                    else:
+                        self.entries[key] = (rating_key, score, tier)
+                if dropped:
+                    print(f"Dropped {dropped} cached results the library changes could affect")
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Error loading match cache: {e}")
+            self.entries.clear()
+            return
+        
+        print(f"Loaded {len(self.entries)} cached matches from: {self.path}")
+    
+    def save(self):
+        """Write all entries for the current library generation to the cache file."""
+        if self.generation is None:
+            return False
+        
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                if conn.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+                    conn.execute("DROP TABLE IF EXISTS generation")
+                    conn.execute("DROP TABLE IF EXISTS matches")
+                    conn.executescript(_SCHEMA)
+                    conn.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+                
+                conn.execute("DELETE FROM generation")
+                conn.execute("DELETE FROM matches")
+                conn.execute("INSERT INTO generation VALUES (?, ?, ?, ?, ?)", self.generation + (self.track_count,))
+                conn.executemany("INSERT INTO matches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (key + value for key, value in self.entries.items()))
+            print(f"Match cache saved to: {self.path}")
+            return True
+        except Exception as e:
+            print(f"Error saving match cache: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def lookup(self, track_info, threshold, library_index):
+        """Return the cached (rating key, score) of a query, or None if it isn't cached.
+
+        A cached "no match" comes back as (None, None).
+        """
+        key = _query_key(track_info, threshold)
+        cached = self.entries.get(key)
+        
+        if cached is not None and cached[0] is not None and cached[0] not in library_index.tracks:
+            del self.entries[key]
+            cached = None
+        
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cached[:2]
+    
+    def store(self, track_info, threshold, rating_key, score, tier=None):
+        """Remember the result of a query and the tier that found it; pass None for all when nothing matched."""
+        self.entries[_query_key(track_info, threshold)] = (rating_key, score, tier)
+    
+    def add_result(self, track_info, threshold, rating_key, score, tier, hit):
+        """Count and store a lookup that was made on a copy of this cache, e.g. in a worker process."""
+        if hit:
+            self.hits += 1  # Already stored, with the tier that originally found it
+        else:
+            self.misses += 1
+            self.store(track_info, threshold, rating_key, score, tier)
+    
+    def summary(self):
+        """One-line hit/miss report for the run summary."""
+        lookups = self.hits + self.misses
+        hit_percent = (self.hits / lookups) * 100 if lookups else 0
+        return f"Match cache: {self.hits} hits, {self.misses} misses ({hit_percent:.1f}% hit rate)"
+
+def _query_key(track_info, threshold):
+    """Cache key of a playlist entry: normalized artist, title and album, duration (0 if unknown),
+    path key ('' if none) and threshold."""
+    return (normalize_string(track_info['artist']), normalize_string(track_info['title']),
+            normalize_string(track_info.get('album')), track_info.get('duration') or 0,
+            get_path_key(track_info.get('path')) or '', float(threshold))
+
+def _stale_filter(changed, library_index):
+    """Return a predicate telling whether a cached entry could come out differently after a refresh.
+
+    ``changed`` holds the track and artist records the refresh touched. An
+    entry whose path still resolves to the same track is kept, since the
+    path tier decides it first. Other hits are kept unless their track
+    changed or a changed track's title, or its canonical key, is that of
+    the entry's title or a prefix of it (which covers the search-cleaned
+    and alternative titles). Canonical and artist tier hits also depend on
+    find_artist() and are dropped when any artist changed, and artist tier
+    hits when a track of their artist changed. Misses and the featured and
+    fuzzy tiers, which score titles across the library, are dropped.
+    """
+    rating_keys = set()
+    titles = set()  # Normalized titles with the spaces removed
+    canonical_titles = set()
+    artist_keys = set()
+    artists_changed = False
+    
+    for record in changed:
+        if isinstance(record, ArtistRecord):
+            artists_changed = True
+            continue
+        rating_keys.add(record.rating_key)
+        artist_keys.add(record.artist_key)
+        for title in (record.norm_title, record.base_title, record.clean_title):
+            titles.add(title.replace(' ', ''))
+            canonical_titles.add(get_canonical_key(title))
+    
+    def is_stale(key, rating_key, tier):
+        title, path_key = key[1], key[4]
+        if path_key and library_index.path_index:
+            record = library_index.path_index.get(path_key)
+            if record is not None:
+                return record.rating_key != rating_key
+        if tier not in ('exact', 'canonical', 'artist') or rating_key in rating_keys:
+            return True
+        if tier != 'exact' and artists_changed:
+            return True
+        if tier == 'artist':
+            record = library_index.tracks.get(rating_key)
+            if record is None or record.artist_key in artist_keys:
+                return True
+        joined = title.replace(' ', '')
+        if any(joined[:end] in titles for end in range(1, len(joined) + 1)):
+            return True
+        words = title.split()
+        return any(get_canonical_key(' '.join(words[:end])) in canonical_titles for end in range(1, len(words) + 1))
+    
+    return is_stale
+
+def _library_generation(library_index):
+    """Identify the library state cached results depend on, or None if it is unknown."""
+    if library_index.last_updated is None:
+        return None
+    return (library_index.machine_identifier or '', str(library_index.section_key), library_index.last_updated,
+            library_index.duration_tolerance or 0)
@@ -0,0 +1,219 @@
+import contextlib
+import io
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from .track_finder import find_best_match
+from .string_utils import get_path_key
+
+# Order of the match tiers in tier_summary(): cached results first, then find_track's tiers
+MATCH_TIERS = ('cached', 'path', 'exact', 'canonical', 'featured', 'artist', 'fuzzy')
+
+# Number of playlist entries handed to the worker pool at a time when matching a stream of entries
+WORKER_BATCH_SIZE = 2000
+
+# Library index and match cache of a worker process, set by _init_worker()
+_worker_index = None
+_worker_cache = None
+
+class PlaylistMatcher:
+    """Match parsed playlist entries against the library index.
+
+    With ``workers`` > 1 the entries are spread over a pool of worker
+    processes, each holding its own copy of the index. Workers only search
+    the built index and have no Plex connection. They send back rating
+    keys, scores and their console output, which is replayed in playlist
+    order, so both the matches and the log are the same as in serial mode.
+    Use it as a context manager so the pool is shut down.
+
+    Entries may come from a generator such as iter_m3u8(); they are matched
+    as they arrive, in batches of WORKER_BATCH_SIZE when using workers.
+
+    A MatchCache passed as ``match_cache`` is consulted for every entry. Each
+    worker looks up and stores in its own copy; the parent counts and keeps
+    what they report.
+    """
+    
+    def __init__(self, plex, library_index, threshold=0.75, verbose=False, workers=1, match_cache=None):
+        self.plex = plex
+        self.library_index = library_index
+        self.threshold = threshold
+        self.verbose = verbose
+        self.workers = workers or 1
+        self.match_cache = match_cache
+        self.tier_counts = Counter()  # Maps match tier to the number of entries it matched
+        self.executor = None
+        
+        # Workers can't build a missing index, so without one the entries are matched here
+        if self.workers > 1 and library_index.initialized:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                initargs=(library_index, match_cache))
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def close(self):
+        """Shut down the worker pool, if any."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+    
+    def match(self, tracks_info):
+        """Match playlist entries; return (matched track records, missing entries) in playlist order."""
+        matched_tracks = []
+        missing_tracks = []
+        
+        for track_info, record in self.iter_resolve(tracks_info):
+            if record is None:
+                missing_tracks.append(track_info)
+            else:
+                matched_tracks.append(record)
+        
+        return matched_tracks, missing_tracks
+    
+    def resolve(self, tracks_info):
+        """Match playlist entries; return the matched track record (or None) of each, in order."""
+        return [record for _, record in self.iter_resolve(tracks_info)]
+    
+    def iter_resolve(self, tracks_info):
+        """Yield (entry, matched track record or None) for playlist entries as they are matched.
+
+        ``tracks_info`` may be any iterable; it is consumed lazily.
+        """
+        print("Finding tracks in Plex library...")
+        
+        total = len(tracks_info) if hasattr(tracks_info, '__len__') else None
+        entries = ((i, total, track_info) for i, track_info in enumerate(tracks_info))
+        if self.executor is None:
+            results = ((entry[2], _match_entry(self.plex, self.library_index, entry, self.threshold, self.verbose,
+                                               self.match_cache))
+                       for entry in entries)
+        else:
+            results = self._match_in_workers(entries)
+        
+        for track_info, (rating_key, score, tier, log, cache_hit) in results:
+            if log:
+                print(log, end='')
+            if self.executor is not None and self.match_cache is not None:
+                self.match_cache.add_result(track_info, self.threshold, rating_key, score, tier, cache_hit)
+            if tier:
+                self.tier_counts[tier] += 1
+            yield track_info, (self.library_index.tracks[rating_key] if rating_key is not None else None)
+    
+    def _match_in_workers(self, entries):
+        """Yield (entry, result) from the worker pool, submitting the next batch before draining the current one."""
+        current = None
+        while True:
+            batch = list(islice(entries, WORKER_BATCH_SIZE))
+            if batch:
+                chunksize = max(1, len(batch) // (self.workers * 4))
+                results = self.executor.map(_match_entry_in_worker, batch,
+                                            [self.threshold] * len(batch), [self.verbose] * len(batch),
+                                            chunksize=chunksize)
+            if current is not None:
+                yield from current
+            if not batch:
+                return
+            current = ((entry[2], result) for entry, result in zip(batch, results))
+    
+    def resolve_distinct(self, playlists):
+        """Resolve every distinct query across several parsed playlists exactly once.
+
+        Returns a dict mapping query_key() to the matched track record or None,
+        for use with split_resolved().
+        """
+        queries = {}
+        total = 0
+        for tracks_info in playlists:
+            for track_info in tracks_info:
+                queries.setdefault(query_key(track_info), track_info)
+                total += 1
+        
+        print(f"\nResolving {len(queries)} distinct tracks from {total} playlist entries")
+        records = self.resolve(list(queries.values()))
+        
+        saved = total - len(queries)
+        saved_percent = (saved / total) * 100 if total else 0
+        print(f"\nSaved {saved} of {total} track lookups ({saved_percent:.1f}%) by resolving duplicates once")
+        
+        return dict(zip(queries, records))
+    
+    def tier_summary(self):
+        """One-line report of which tier produced how many of the matches so far."""
+        total = sum(self.tier_counts.values())
+        if not total:
+            return "Match tiers: no matches"
+        
+        parts = []
+        for tier in MATCH_TIERS:
+            count = self.tier_counts[tier]
+            if count:
+                parts.append(f"{tier} {count} ({count / total * 100:.1f}%)")
+        summary = "Match tiers: " + ", ".join(parts)
+        
+        # Canonical key hits would otherwise have gone on to the featured, artist and fuzzy tiers
+        if self.tier_counts['canonical']:
+            summary += f"; canonical keys avoided {self.tier_counts['canonical']} fuzzy scans"
+        return summary
+
+def query_key(track_info):
+    """Key identifying a playlist entry for matching: its (artist, title, album, duration, path key).
+
+    The path key is part of it because the path tier can match entries
+    that agree on everything else to different tracks.
+    """
+    return (track_info['artist'], track_info['title'], track_info.get('album'), track_info.get('duration'),
+            get_path_key(track_info.get('path')))
+
+def split_resolved(tracks_info, resolved):
+    """Split playlist entries into (matched track records, missing entries) using resolved query results."""
+    matched_tracks = []
+    missing_tracks = []
+    
+    for track_info in tracks_info:
+        record = resolved[query_key(track_info)]
+        if record is None:
+            missing_tracks.append(track_info)
+        else:
+            matched_tracks.append(record)
+    
+    return matched_tracks, missing_tracks
+
+def _match_entry(plex, library_index, entry, threshold, verbose, match_cache=None):
+    """Match one playlist entry.
+
+    Returns (rating key or None, score or None, match tier or None, captured
+    log, cache hit); the last two are only filled in by worker processes.
+    """
+    i, total, track_info = entry
+    position = f"{i+1}/{total}" if total is not None else f"{i+1}"
+    print(f"\nProcessing track {position}: {track_info['artist']} - {track_info['title']}")
+    
+    best_match = find_best_match(plex, track_info, library_index, threshold, verbose, match_cache)
+    
+    if best_match:
+        return best_match['track'].rating_key, best_match['score'], best_match.get('tier'), None, None
+    
+    print(f"No match found for: {track_info['artist']} - {track_info['title']}")
+    return None, None, None, None, None
+
+def _init_worker(library_index, match_cache):
+    """Set up a worker process with its copy of the index; workers don't talk to the server."""
+    global _worker_index, _worker_cache
+    library_index.plex = None
+    _worker_index = library_index
+    _worker_cache = match_cache
+
+def _match_entry_in_worker(entry, threshold, verbose):
+    """Match one playlist entry in a worker process, capturing its console output."""
+    log = io.StringIO()
+    hits = _worker_cache.hits if _worker_cache is not None else 0
+    with contextlib.redirect_stdout(log):
+        rating_key, score, tier, _, _ = _match_entry(_worker_index.plex, _worker_index, entry, threshold, verbose,
+                                                     _worker_cache)
+    cache_hit = _worker_cache is not None and _worker_cache.hits > hits
+    return rating_key, score, tier, log.getvalue(), cache_hit
@@ -0,0 +1,76 @@
+import heapq
+from collections import Counter, defaultdict
+
+from .string_utils import get_ngrams
+
+# Strings this short get a flat similarity bonus in get_multi_similarity when
+# one is a whole word of the other, regardless of shared n-grams
+SHORT_WORD_LENGTH = 5
+
+
+class NgramIndex:
+    """Character n-gram posting lists over a set of normalized strings.
+
+    Used to pick the few indexed strings worth scoring against a query
+    instead of scoring every one of them.
+    """
+    
+    def __init__(self, n=3):
+        self.n = n
+        self.keys = []  # Maps key id to key, in insertion order
+        self.key_ids = {}  # Maps key to key id
+        self.gram_counts = []  # Maps key id to its number of distinct n-grams
+        self.postings = defaultdict(list)  # Maps n-gram to key ids containing it
+        self.words = defaultdict(list)  # Maps short whole words to key ids containing them
+    
+    def __len__(self):
+        return len(self.keys)
+    
+    def add(self, key):
+        """Add a key to the index. Keys already present are ignored."""
+        if not key or key in self.key_ids:
+            return
+        
+        key_id = len(self.keys)
+        self.keys.append(key)
+        self.key_ids[key] = key_id
+        
+        grams = set(get_ngrams(key, self.n))
+        self.gram_counts.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(key_id)
+        
+        for word in set(key.split()):
+            if len(word) <= SHORT_WORD_LENGTH:
+                self.words[word].append(key_id)
+    
+    def candidates(self, query, limit=50):
+        """Return indexed keys likely to be similar to the query, in insertion order.
+
+        These are the ``limit`` keys with the highest n-gram Dice coefficient,
+        plus every key that is a short whole word of the query or contains a
+        short query as a whole word.
+        """
+        if not query:
+            return []
+        
+        grams = set(get_ngrams(query, self.n))
+        counts = Counter()
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting:
+                counts.update(posting)
+        
+        total = len(grams)
+        gram_counts = self.gram_counts
+        best = heapq.nlargest(limit, counts.items(),
+                              key=lambda item: 2 * item[1] / (total + gram_counts[item[0]]))
+        selected = {key_id for key_id, _ in best}
+        
+        if len(query) <= SHORT_WORD_LENGTH and ' ' not in query:
+            selected.update(self.words.get(query, ()))
+        for word in query.split():
+            if len(word) <= SHORT_WORD_LENGTH and word in self.key_ids:
+                selected.add(self.key_ids[word])
+        
+        return [self.keys[key_id] for key_id in sorted(selected)]
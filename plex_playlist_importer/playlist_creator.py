@@ -2,6 +2,8 @@ import os
 import time
 import re
 
+from .playlist_sync import PLAYLIST_BATCH_SIZE
+
 def handle_existing_playlist(plex, playlist_name, matched_tracks):
     """
     Handle an existing playlist with the given name.
@@ -33,7 +35,8 @@ def handle_existing_playlist(plex, playlist_name, matched_tracks):
                 
                 if new_tracks:
                     print(f"Adding {len(new_tracks)} new tracks to existing playlist")
-                    existing_playlist.addItems(new_tracks)
+                    for i in range(0, len(new_tracks), PLAYLIST_BATCH_SIZE):
+                        existing_playlist.addItems(new_tracks[i:i + PLAYLIST_BATCH_SIZE])
                     print(f"Added {len(new_tracks)} tracks to existing playlist")
                 else:
                     print("No new tracks to add to existing playlist")
@@ -67,8 +70,10 @@ def create_plex_playlist(plex, playlist_name, matched_tracks, skip_confirmation=
             print("Playlist creation cancelled.")
             return None
     
-    # Create the playlist
-    playlist = plex.createPlaylist(playlist_name, items=matched_tracks)
+    # Create the playlist, adding large ones in batches to keep each request small
+    playlist = plex.createPlaylist(playlist_name, items=matched_tracks[:PLAYLIST_BATCH_SIZE])
+    for i in range(PLAYLIST_BATCH_SIZE, len(matched_tracks), PLAYLIST_BATCH_SIZE):
+        playlist.addItems(matched_tracks[i:i + PLAYLIST_BATCH_SIZE])
     print(f"Playlist '{playlist_name}' created with {len(matched_tracks)} tracks")
     
     return playlist
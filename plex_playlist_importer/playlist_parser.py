@@ -1,77 +1,165 @@
+import codecs
 import os
 import re
+import sys
+
+# "#EXTINF:<seconds>[ attributes],<display title>"
+EXTINF_PATTERN = re.compile(r'^#EXTINF:\s*(-?\d+(?:\.\d+)?)[^,]*,(.*)$')
+
+# Byte order marks and the text encoding they announce, longest first
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+def parse_extinf(line):
+    """Parse an #EXTINF line into (duration in seconds or None, artist or None, title or None)."""
+    extinf_match = EXTINF_PATTERN.match(line)
+    if not extinf_match:
+        return None, None, None
+    
+    duration = float(extinf_match.group(1))
+    duration = int(round(duration)) if duration > 0 else None  # -1 means unknown
+    
+    display = extinf_match.group(2).strip()
+    if ' - ' in display:
+        artist, title = display.split(' - ', 1)
+        return duration, artist.strip() or None, title.strip() or None
+    return duration, None, display or None
 
 def parse_m3u8(file_path):
-    """Parse M3U8 file and extract track information."""
-    tracks = []
+    """Parse M3U8 file and extract track information.
+
+    Each entry carries the 'duration' in seconds from its #EXTINF line, or
+    None. When the path itself doesn't match a known format, the artist and
+    title of the #EXTINF line are used instead. See iter_m3u8() to read the
+    entries one at a time.
+    """
+    return list(iter_m3u8(file_path))
+
+def iter_m3u8(file_path):
+    """Yield the track entries of an M3U8 file as its lines are read.
+
+    Files starting with a UTF-8, UTF-16 or UTF-32 byte order mark are
+    decoded accordingly. Other files are read as UTF-8, line by line, with
+    Latin-1 as the fallback for lines that aren't valid UTF-8 (as in older
+    .m3u exports).
+    """
+    count = 0
     
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-            for line in f:
-                line = line.strip()
-                # Skip empty lines and comments
-                if not line or line.startswith('#'):
-                    continue
-                
-                try:
-                    # Try standard format with path structure: Album Artist/Album/tracknumber - trackname
-                    if '/' in line:
-                        path_parts = line.split('/')
-                        if len(path_parts) >= 3:
-                            artist = path_parts[0]
-                            album = path_parts[1]
-                            
-                            remaining_path = '/'.join(path_parts[2:])
-                            filename = os.path.basename(remaining_path)
-                            file_extension = os.path.splitext(filename)[1].lower()
-                            
-                            title_match = re.search(r'^\d+\s*-\s*(.*)', filename)
-                            if title_match:
-                                title = title_match.group(1)
-                                title = os.path.splitext(title)[0].strip()
-                            else:
-                                title = os.path.splitext(filename)[0].strip()
-                            
-                            tracks.append({
-                                'artist': artist,
-                                'album': album,
-                                'title': title,
-                                'path': line,
-                                'extension': file_extension
-                            })
-                        else:
-                            print(f"Warning: Line does not match expected path format: {line}")
-                    
-                    # Handle flat format "Artist - Title.ext" (with or without multiple artists)
-                    elif ' - ' in line:
-                        artist_part, title_part = line.split(' - ', 1)
-                        
-                        # Handle multiple artists separated by commas - only keep first artist
-                        if ',' in artist_part:
-                            artist = artist_part.split(',', 1)[0].strip()
-                            print(f"Multiple artists detected: '{artist_part}' -> using '{artist}'")
-                        else:
-                            artist = artist_part.strip()
-                        
-                        title = os.path.splitext(title_part)[0].strip()
-                        file_extension = os.path.splitext(title_part)[1].lower()
-                        
-                        tracks.append({
-                            'artist': artist,
-                            'album': None,
-                            'title': title,
-                            'path': line,
-                            'extension': file_extension
-                        })
-                    else:
-                        print(f"Warning: Line does not match any expected format: {line}")
-                except Exception as e:
-                    print(f"Error parsing line: {line}")
-                    print(f"Error details: {e}")
-        
-        print(f"Successfully parsed {len(tracks)} tracks from playlist")
-        return tracks
+        extinf = (None, None, None)  # Metadata of the #EXTINF line before the current entry
+        for line in _read_lines(file_path):
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                extinf = parse_extinf(line)
+                continue
+            
+            # Skip empty lines and comments
+            if not line or line.startswith('#'):
+                continue
+            
+            try:
+                track = _parse_entry(line, *extinf)
+            except Exception as e:
+                print(f"Error parsing line: {line}")
+                print(f"Error details: {e}")
+                track = None
+            
+            extinf = (None, None, None)
+            if track is not None:
+                count += 1
+                yield track
         
+        print(f"Successfully parsed {count} tracks from playlist")
+    
     except Exception as e:
         print(f"Error reading playlist file: {e}")
-        return []
\ No newline at end of file
+
+def _read_lines(file_path):
+    """Yield the decoded lines of a playlist file."""
+    with open(file_path, 'rb') as f:
+        head = f.read(4)
+        for bom, encoding in BOM_ENCODINGS:
+            if head.startswith(bom):
+                f.seek(len(bom))
+                yield from codecs.getreader(encoding)(f, errors='replace')
+                return
+        
+        f.seek(0)
+        for raw_line in f:
+            try:
+                yield raw_line.decode('utf-8')
+            except UnicodeDecodeError:
+                yield raw_line.decode('latin-1')
+
+def _parse_entry(line, duration, extinf_artist, extinf_title):
+    """Turn one playlist path into a track entry, or None if its format isn't recognized."""
+    # Try standard format with path structure: Album Artist/Album/tracknumber - trackname
+    if '/' in line:
+        path_parts = line.split('/')
+        if len(path_parts) >= 3:
+            artist = path_parts[0]
+            album = path_parts[1]
+            
+            remaining_path = '/'.join(path_parts[2:])
+            filename = os.path.basename(remaining_path)
+            file_extension = os.path.splitext(filename)[1].lower()
+            
+            title_match = re.search(r'^\d+\s*-\s*(.*)', filename)
+            if title_match:
+                title = title_match.group(1)
+                title = os.path.splitext(title)[0].strip()
+            else:
+                title = os.path.splitext(filename)[0].strip()
+            
+            return _track(artist, album, title, line, file_extension, duration)
+        
+        if extinf_artist and extinf_title:
+            return _extinf_track(line, extinf_artist, extinf_title, duration)
+        
+        print(f"Warning: Line does not match expected path format: {line}")
+        return None
+    
+    # Handle flat format "Artist - Title.ext" (with or without multiple artists)
+    if ' - ' in line:
+        artist_part, title_part = line.split(' - ', 1)
+        
+        # Handle multiple artists separated by commas - only keep first artist
+        if ',' in artist_part:
+            artist = artist_part.split(',', 1)[0].strip()
+            print(f"Multiple artists detected: '{artist_part}' -> using '{artist}'")
+        else:
+            artist = artist_part.strip()
+        
+        title = os.path.splitext(title_part)[0].strip()
+        file_extension = os.path.splitext(title_part)[1].lower()
+        
+        return _track(artist, None, title, line, file_extension, duration)
+    
+    if extinf_artist and extinf_title:
+        return _extinf_track(line, extinf_artist, extinf_title, duration)
+    
+    print(f"Warning: Line does not match any expected format: {line}")
+    return None
+
+def _extinf_track(line, artist, title, duration):
+    """Build a track entry from #EXTINF metadata for a path in an unrecognized format."""
+    if ',' in artist:
+        artist = artist.split(',', 1)[0].strip()
+    
+    return _track(artist, None, title, line, os.path.splitext(line)[1].lower(), duration)
+
+def _track(artist, album, title, path, extension, duration):
+    """Build a track entry. Artist, album and extension repeat across a playlist, so they are interned."""
+    return {
+        'artist': sys.intern(artist),
+        'album': sys.intern(album) if album is not None else None,
+        'title': title,
+        'path': path,
+        'extension': sys.intern(extension),
+        'duration': duration
+    }
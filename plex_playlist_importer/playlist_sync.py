@@ -0,0 +1,171 @@
+import bisect
+import threading
+from collections import Counter, defaultdict, deque
+
+from plexapi import utils
+
+# Number of rating keys sent per add request, which keeps request URLs bounded
+PLAYLIST_BATCH_SIZE = 500
+
+class PlaylistCatalog:
+    """Titles of the server's audio playlists, fetched once per run and kept current by sync_playlist()."""
+    
+    def __init__(self, plex):
+        self.plex = plex
+        self.lock = threading.Lock()
+        self.playlists = {}  # Maps title to (playlist rating key, smart)
+        
+        for elem in plex.query('/playlists?playlistType=audio'):
+            if 'ratingKey' in elem.attrib:
+                self.playlists.setdefault(elem.attrib.get('title', ''),
+                                          (int(elem.attrib['ratingKey']), elem.attrib.get('smart') == '1'))
+    
+    def get(self, title):
+        """Return (rating key, smart) of the playlist with this title, or None."""
+        with self.lock:
+            return self.playlists.get(title)
+    
+    def set(self, title, rating_key, smart=False):
+        with self.lock:
+            self.playlists[title] = (rating_key, smart)
+
+def sync_playlist(plex, catalog, playlist_name, rating_keys, batch_size=PLAYLIST_BATCH_SIZE):
+    """Make the playlist titled ``playlist_name`` hold exactly ``rating_keys``, in order.
+
+    A new playlist is created in batches of ``batch_size`` keys. An existing
+    one is only changed where it differs: surplus entries are removed,
+    missing ones appended in batches, and then the fewest entries needed
+    to restore the order are moved, so untouched entries keep their
+    playlist history. Smart playlists can't be edited and are replaced.
+    Returns a dict with 'added', 'removed', 'moved' and 'kept' counts.
+    """
+    existing = catalog.get(playlist_name)
+    if existing is not None and existing[1]:
+        plex.query(f'/playlists/{existing[0]}', method=plex._session.delete)
+        existing = None
+    
+    if existing is None:
+        rating_key = create_playlist(plex, playlist_name, rating_keys, batch_size)
+        catalog.set(playlist_name, rating_key)
+        print(f"Playlist '{playlist_name}' created with {len(rating_keys)} tracks")
+        return {'added': len(rating_keys), 'removed': 0, 'moved': 0, 'kept': 0}
+    
+    playlist_key = f'/playlists/{existing[0]}'
+    stats = {'added': 0, 'removed': 0, 'moved': 0, 'kept': 0}
+    
+    # Keep as many existing entries of each track as the new list has, earliest first
+    wanted = Counter(rating_keys)
+    for rating_key, item_id in playlist_entries(plex, playlist_key, batch_size):
+        if wanted[rating_key] > 0:
+            wanted[rating_key] -= 1
+            stats['kept'] += 1
+        else:
+            plex.query(f'{playlist_key}/items/{item_id}', method=plex._session.delete)
+            stats['removed'] += 1
+    
+    # Whatever is still wanted gets appended, and put in place by the moves below
+    missing = []
+    for rating_key in rating_keys:
+        if wanted[rating_key] > 0:
+            wanted[rating_key] -= 1
+            missing.append(rating_key)
+    for i in range(0, len(missing), batch_size):
+        add_to_playlist(plex, playlist_key, missing[i:i + batch_size])
+    stats['added'] = len(missing)
+    
+    stats['moved'] = _restore_order(plex, playlist_key, rating_keys, batch_size)
+    
+    print(f"Playlist '{playlist_name}' synced: {stats['added']} added, {stats['removed']} removed, "
+          f"{stats['moved']} moved, {stats['kept']} kept")
+    return stats
+
+def create_playlist(plex, title, rating_keys, batch_size=PLAYLIST_BATCH_SIZE):
+    """Create an audio playlist from rating keys, in batches; return its rating key."""
+    args = {'uri': _items_uri(plex, rating_keys[:batch_size]), 'type': 'audio', 'title': title, 'smart': 0}
+    data = plex.query(f'/playlists{utils.joinArgs(args)}', method=plex._session.post)
+    rating_key = int(data[0].attrib['ratingKey'])
+    
+    for i in range(batch_size, len(rating_keys), batch_size):
+        add_to_playlist(plex, f'/playlists/{rating_key}', rating_keys[i:i + batch_size])
+    return rating_key
+
+def add_to_playlist(plex, playlist_key, rating_keys):
+    """Append tracks to the end of a playlist in one request."""
+    args = {'uri': _items_uri(plex, rating_keys)}
+    plex.query(f'{playlist_key}/items{utils.joinArgs(args)}', method=plex._session.put)
+
+def playlist_entries(plex, playlist_key, page_size=PLAYLIST_BATCH_SIZE):
+    """Return the (track rating key, playlist item id) of every entry of a playlist, in order."""
+    entries = []
+    start = 0
+    while True:
+        data = plex.query(f'{playlist_key}/items', headers={'X-Plex-Container-Start': str(start),
+                                                            'X-Plex-Container-Size': str(page_size)})
+        page = [(int(elem.attrib['ratingKey']), int(elem.attrib['playlistItemID']))
+                for elem in data if 'playlistItemID' in elem.attrib]
+        entries.extend(page)
+        start += page_size
+        total = int(data.attrib.get('totalSize') or data.attrib.get('size') or 0)
+        if not page or start >= total:
+            return entries
+
+def _restore_order(plex, playlist_key, rating_keys, batch_size):
+    """Move playlist entries into the order of ``rating_keys``; return the number of moves.
+
+    Entries already in a longest increasing run of target positions stay
+    put, and every other entry is moved right after its predecessor.
+    """
+    # The n-th entry of a track goes where the n-th occurrence of the track is wanted
+    targets = defaultdict(deque)
+    for position, rating_key in enumerate(rating_keys):
+        targets[rating_key].append(position)
+    
+    item_ids = [None] * len(rating_keys)
+    positions = []
+    for rating_key, item_id in playlist_entries(plex, playlist_key, batch_size):
+        if not targets[rating_key]:
+            continue  # Added by someone else meanwhile; leave it where it is
+        position = targets[rating_key].popleft()
+        item_ids[position] = item_id
+        positions.append(position)
+    
+    in_place = _longest_increasing(positions)
+    moved = 0
+    previous_id = None
+    for position, item_id in enumerate(item_ids):
+        if item_id is None:
+            continue
+        if position not in in_place:
+            key = f'{playlist_key}/items/{item_id}/move'
+            if previous_id is not None:
+                key += f'?after={previous_id}'
+            plex.query(key, method=plex._session.put)
+            moved += 1
+        previous_id = item_id
+    return moved
+
+def _longest_increasing(values):
+    """Return the set of values in a longest strictly increasing subsequence (values are distinct)."""
+    tails = []  # Smallest tail value of an increasing run of each length
+    tail_index = []  # Index in values of each of those tails
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        length = bisect.bisect_left(tails, value)
+        if length == len(tails):
+            tails.append(value)
+            tail_index.append(i)
+        else:
+            tails[length] = value
+            tail_index[length] = i
+        previous[i] = tail_index[length - 1] if length else -1
+    
+    result = set()
+    i = tail_index[-1] if tail_index else -1
+    while i >= 0:
+        result.add(values[i])
+        i = previous[i]
+    return result
+
+def _items_uri(plex, rating_keys):
+    """Library URI of a list of tracks, as used when creating or adding to playlists."""
+    return f"{plex._uriRoot()}/library/metadata/{','.join(str(rating_key) for rating_key in rating_keys)}"
@@ -0,0 +1,260 @@
+import contextlib
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import numpy as np
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+
+# Number of Plex requests kept in flight while building or refreshing the index
+DEFAULT_CONCURRENCY = 4
+
+# Times a failed request is retried before giving up
+DEFAULT_RETRIES = 4
+
+# Base and cap (seconds) of the jittered exponential backoff between retries
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_CAP = 30.0
+
+# Responses meaning the server is overloaded or briefly unavailable
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# Responses meaning the server refused the request without acting on it, so even a POST can be retried
+REFUSED_STATUSES = frozenset((429, 503))
+
+# Methods that may be sent again after the server may have acted on them
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'))
+
+# Paths where a PUT appends (adding items to a playlist), so sending it twice adds the items twice
+APPENDING_PUT_PATH = re.compile(r'/playlists/\d+/items/?$')
+
+class RequestBudgetExceeded(Exception):
+    """Raised when a run has used up its budget of Plex requests."""
+
+class AdaptiveLimiter:
+    """Concurrency limit that grows by one per window of successes and halves on failure (AIMD)."""
+    
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.active = 0
+        self.condition = threading.Condition()
+    
+    def __enter__(self):
+        with self.condition:
+            while self.active >= max(1, int(self.limit)):
+                self.condition.wait()
+            self.active += 1
+        return self
+    
+    def __exit__(self, *exc_info):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+    
+    def succeeded(self):
+        """Additive increase: about +1 after ``limit`` successful requests."""
+        with self.condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+    
+    def failed(self):
+        """Multiplicative decrease."""
+        with self.condition:
+            self.limit = max(1.0, self.limit / 2)
+    
+    def resize(self, maximum):
+        """Raise the ceiling of the limit, e.g. when more requests are put in flight."""
+        with self.condition:
+            if maximum > self.maximum:
+                self.maximum = maximum
+                self.condition.notify_all()
+
+class PlexRequestLayer(HTTPAdapter):
+    """Transport adapter that every request of a Plex connection goes through.
+
+    It keeps the number of requests in flight under an AIMD limit, retries
+    timeouts, connection errors and overload responses (5xx, 429) with
+    jittered exponential backoff, honouring Retry-After, and stops the run
+    with RequestBudgetExceeded once ``budget`` requests (retries included)
+    have been sent. Requests the server may already have acted on are only
+    retried when they are idempotent, which excludes the PUT that appends
+    items to a playlist.
+    """
+    
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES, budget=None):
+        super().__init__(pool_connections=DEFAULT_POOLSIZE, pool_maxsize=max(concurrency, DEFAULT_POOLSIZE))
+        self.retries = retries
+        self.budget = budget
+        self.limiter = AdaptiveLimiter(concurrency)
+        self.counter_lock = threading.Lock()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+    
+    def resize(self, concurrency):
+        """Allow up to ``concurrency`` requests in flight over as many keep-alive connections."""
+        if concurrency > self._pool_maxsize:
+            self.init_poolmanager(DEFAULT_POOLSIZE, concurrency)
+        self.limiter.resize(concurrency)
+    
+    def send(self, request, stream=False, **kwargs):
+        for attempt in range(self.retries + 1):
+            self._spend()
+            response = error = None
+            with self.limiter:
+                try:
+                    response = super().send(request, stream=stream, **kwargs)
+                    if not stream:
+                        response.content  # Read the body while holding the slot
+                except (ConnectionError, Timeout) as e:
+                    error = e
+            
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                self.limiter.succeeded()
+                return response
+            
+            self.limiter.failed()
+            if attempt == self.retries or not self._may_retry(request, response, error):
+                with self.counter_lock:
+                    self.failed += 1
+                if error is not None:
+                    raise error
+                return response
+            
+            with self.counter_lock:
+                self.retried += 1
+            time.sleep(self._backoff(attempt, response))
+    
+    def _spend(self):
+        """Count a request against the budget."""
+        with self.counter_lock:
+            if self.budget is not None and self.sent >= self.budget:
+                raise RequestBudgetExceeded(f"Plex request budget of {self.budget} requests used up")
+            self.sent += 1
+    
+    def _may_retry(self, request, response, error):
+        """Whether sending the request again can't repeat an action the server already took."""
+        if _is_idempotent(request):
+            return True
+        if error is not None:
+            return isinstance(error, ConnectTimeout)  # Never reached the server
+        return response.status_code in REFUSED_STATUSES
+    
+    def _backoff(self, attempt, response):
+        """Seconds to wait before the next attempt: Retry-After if given, else full-jitter exponential."""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), RETRY_BACKOFF_CAP)
+        return random.uniform(0, min(RETRY_BACKOFF_CAP, RETRY_BACKOFF * 2 ** attempt))
+    
+    def summary(self):
+        """One-line report of requests sent, retried and given up on."""
+        return (f"Plex request layer: {self.sent} requests sent, {self.retried} retried, {self.failed} failed, "
+                f"concurrency limit {self.limiter.limit:.1f}")
+
+def _is_idempotent(request):
+    """Whether sending a request twice has the same effect as sending it once."""
+    if request.method == 'PUT' and APPENDING_PUT_PATH.search(urlsplit(request.url).path):
+        return False
+    return request.method in IDEMPOTENT_METHODS
+
+def mount_request_layer(session, concurrency=DEFAULT_CONCURRENCY, retries=DEFAULT_RETRIES, budget=None):
+    """Route every request of a requests session through a new PlexRequestLayer and return it.
+
+    Pass the session to PlexServer(session=...) so even connecting goes through it.
+    """
+    layer = PlexRequestLayer(concurrency, retries, budget)
+    session.mount('http://', layer)
+    session.mount('https://', layer)
+    return layer
+
+def get_request_layer(plex):
+    """Return the PlexRequestLayer of a Plex connection, or None."""
+    session = getattr(plex, '_session', None)
+    if session is None:
+        return None
+    layer = session.get_adapter(plex._baseurl)
+    return layer if isinstance(layer, PlexRequestLayer) else None
+
+# Latency percentiles shown in RequestStats.summary()
+LATENCY_PERCENTILES = (50, 90, 99)
+
+def use_connection_pool(plex, size):
+    """Let a Plex connection keep up to ``size`` requests in flight over keep-alive connections.
+
+    Installs a PlexRequestLayer with default settings if the connection has none yet.
+    """
+    if getattr(plex, '_session', None) is None:
+        return
+    
+    layer = get_request_layer(plex) or mount_request_layer(plex._session, size)
+    layer.resize(size)
+
+def ordered_map(func, items, concurrency=DEFAULT_CONCURRENCY):
+    """Yield func(item) for every item, in order, running up to ``concurrency`` calls at a time.
+
+    Only about twice ``concurrency`` results are held at once, so items may
+    be a long or lazy sequence. With ``concurrency`` <= 1 the calls run
+    one after another in the calling thread.
+    """
+    if concurrency <= 1:
+        for item in items:
+            yield func(item)
+        return
+    
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= concurrency * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+class RequestStats:
+    """Count, size and latency of the HTTP requests made through a Plex connection."""
+    
+    def __init__(self):
+        self.latencies = []  # Seconds from sending each request to receiving its response headers
+        self.bytes = 0
+        self.lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def observe(self, plex):
+        """Record every response the Plex connection receives inside the with block."""
+        session = getattr(plex, '_session', None)
+        if session is None:
+            yield self
+            return
+        
+        hooks = session.hooks['response']
+        hooks.append(self._record)
+        try:
+            yield self
+        finally:
+            hooks.remove(self._record)
+    
+    def _record(self, response, *args, **kwargs):
+        """requests response hook."""
+        with self.lock:
+            self.latencies.append(response.elapsed.total_seconds())
+            self.bytes += len(response.content)
+        return response
+    
+    def summary(self):
+        """One-line report of the request count, bytes received and latency percentiles."""
+        if not self.latencies:
+            return "Plex requests: none"
+        
+        latencies = np.array(self.latencies) * 1000
+        percentiles = ", ".join(f"p{p} {value:.0f} ms"
+                                for p, value in zip(LATENCY_PERCENTILES,
+                                                    np.percentile(latencies, LATENCY_PERCENTILES)))
+        return (f"Plex requests: {len(self.latencies)}, {self.bytes / 1e6:.1f} MB received, "
+                f"latency {percentiles}, max {latencies.max():.0f} ms")
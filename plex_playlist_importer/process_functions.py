@@ -1,54 +1,121 @@
+import io
 import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
-from .playlist_parser import parse_m3u8
-from .library_index import PlexLibraryIndex
-from .track_finder import find_track_advanced
+from .playlist_parser import parse_m3u8, iter_m3u8
+from .library_index import PlexLibraryIndex, DURATION_TOLERANCE, DEFAULT_PAGE_SIZE
+from .plex_requests import DEFAULT_CONCURRENCY
+from .matching import PlaylistMatcher, split_resolved
+from .match_cache import MatchCache
 from .playlist_creator import create_plex_playlist, save_missing_tracks
+from .playlist_sync import PlaylistCatalog, sync_playlist
+
+def load_library_index(plex, index_cache=None, rebuild_index=False, refresh_index=False,
+                       duration_tolerance=DURATION_TOLERANCE, concurrency=DEFAULT_CONCURRENCY,
+                       page_size=DEFAULT_PAGE_SIZE):
+    """Load the library index from a snapshot, or build it and save a new snapshot.
+
+    With ``refresh_index`` a loaded snapshot is patched with the changes made
+    in Plex since it was saved, and saved again. ``duration_tolerance`` is
+    the duration window (in seconds) of the index's find_track().
+    ``concurrency`` and ``page_size`` control the Plex requests made while
+    building or refreshing. Returns the index and what refresh_index()
+    returned, or None when it wasn't refreshed.
+    """
+    library_index = PlexLibraryIndex(plex)
+    library_index.duration_tolerance = duration_tolerance
+    
+    if index_cache and not rebuild_index:
+        if library_index.load_snapshot(index_cache):
+            refresh = library_index.refresh_index(concurrency=concurrency) if refresh_index else None
+            if refresh is not None:
+                library_index.save_snapshot(index_cache)
+            return library_index, refresh
+        print("No usable library index snapshot found")
+    
+    library_index.build_index(page_size=page_size, concurrency=concurrency)
+    
+    if index_cache and library_index.initialized:
+        library_index.save_snapshot(index_cache)
+    
+    return library_index, None
+
+def load_match_cache(path, library_index, refresh=None):
+    """Open the persistent match cache at path for the given index, or return None without a path.
+
+    ``refresh`` is the result of the index's refresh_index() in this run, if any.
+    """
+    if not path:
+        return None
+    
+    match_cache = MatchCache(path)
+    match_cache.load(library_index, refresh)
+    return match_cache
+
+def open_playlist(playlist_file):
+    """Start streaming the entries of an M3U8 file; return None if it has none.
+
+    The first entry is read up front, so empty playlists are caught before
+    any matching work starts.
+    """
+    entries = iter_m3u8(playlist_file)
+    first = next(entries, None)
+    if first is None:
+        return None
+    return chain([first], entries)
 
 def process_playlist(plex, playlist_file, threshold=0.75, create_playlist=True, 
-                     playlist_name=None, verbose=False, skip_confirmation=False):
+                     playlist_name=None, verbose=False, skip_confirmation=False,
+                     index_cache=None, rebuild_index=False, refresh_index=False, workers=1,
+                     match_cache=None, duration_tolerance=DURATION_TOLERANCE, index_concurrency=DEFAULT_CONCURRENCY,
+                     page_size=DEFAULT_PAGE_SIZE):
+    """Import one M3U8 file.
+
+    The playlist is parsed while it is being matched, so entries are
+    matched as soon as they are read and the parsed file is never held in
+    memory as a whole. Returns the matched track records and the entries
+    that weren't matched.
+    """
     # Parse playlist
     print(f"Parsing playlist: {playlist_file}")
-    tracks_info = parse_m3u8(playlist_file)
+    tracks_info = open_playlist(playlist_file)
     
-    if not tracks_info:
+    if tracks_info is None:
         print("No tracks found in playlist!")
         return [], []
     
-    print(f"Found {len(tracks_info)} tracks in playlist")
-    
     # Build library index
-    print("Building Plex library index...")
-    library_index = PlexLibraryIndex(plex)
-    library_index.build_index()
+    library_index, refresh = load_library_index(plex, index_cache, rebuild_index, refresh_index, duration_tolerance,
+                                                index_concurrency, page_size)
     
     # Find tracks
-    print("Finding tracks in Plex library...")
-    matched_tracks = []
-    missing_tracks = []
-    
-    for i, track_info in enumerate(tracks_info):
-        print(f"\nProcessing track {i+1}/{len(tracks_info)}: {track_info['artist']} - {track_info['title']}")
-        
-        # Find track
-        track = find_track_advanced(plex, track_info, library_index, threshold, verbose)
-        
-        if track:
-            matched_tracks.append(track)
-        else:
-            missing_tracks.append(track_info)
-            print(f"No match found for: {track_info['artist']} - {track_info['title']}")
+    result_cache = load_match_cache(match_cache, library_index, refresh)
+    with PlaylistMatcher(plex, library_index, threshold, verbose, workers, result_cache) as matcher:
+        matched_tracks, missing_tracks = matcher.match(tracks_info)
     
     # Report results
-    match_percent = (len(matched_tracks) / len(tracks_info)) * 100 if tracks_info else 0
-    print(f"\nMatched {len(matched_tracks)} of {len(tracks_info)} tracks ({match_percent:.1f}%)")
+    total_tracks = len(matched_tracks) + len(missing_tracks)
+    match_percent = (len(matched_tracks) / total_tracks) * 100 if total_tracks else 0
+    print(f"\nMatched {len(matched_tracks)} of {total_tracks} tracks ({match_percent:.1f}%)")
+    print(matcher.tier_summary())
+    if result_cache is not None:
+        print(result_cache.summary())
+        result_cache.save()
     
     # Create playlist if requested
     if create_playlist and matched_tracks:
         if not playlist_name:
             playlist_name = os.path.splitext(os.path.basename(playlist_file))[0]
         
-        create_plex_playlist(plex, playlist_name, matched_tracks, skip_confirmation)
+        if skip_confirmation:
+            sync_playlist(plex, PlaylistCatalog(plex), playlist_name,
+                          [record.rating_key for record in matched_tracks])
+        else:
+            create_plex_playlist(plex, playlist_name, library_index.fetch_tracks(matched_tracks), skip_confirmation)
     
     # Save missing tracks
     if missing_tracks:
@@ -58,15 +125,30 @@ def process_playlist(plex, playlist_file, threshold=0.75, create_playlist=True,
     return matched_tracks, missing_tracks
 
 def process_playlist_folder(plex, folder_path, threshold=0.75, create_playlists=True, 
-                          verbose=False, skip_confirmation=False):
+                          verbose=False, skip_confirmation=False, index_cache=None, rebuild_index=False,
+                          refresh_index=False, workers=1, playlist_workers=0, dedupe=False, match_cache=None,
+                          duration_tolerance=DURATION_TOLERANCE, index_concurrency=DEFAULT_CONCURRENCY,
+                          page_size=DEFAULT_PAGE_SIZE):
+    """Import every M3U8 file in a folder, sharing one library index.
+
+    With ``playlist_workers`` > 0, creating each playlist in Plex and writing
+    its missing-track report run on that many background threads while the
+    next playlist is matched. Their output is buffered and printed in
+    playlist order. This needs ``skip_confirmation`` (or no playlist
+    creation), since the confirmation prompts can't run in the background.
+
+    With ``dedupe`` all playlists are parsed first and every distinct
+    (artist, title, album, duration, path) is matched once; the playlists
+    are then built from those shared results.
+    """
     # Check if folder exists
     if not os.path.isdir(folder_path):
         print(f"Error: Folder not found: {folder_path}")
         return {}
     
     # Find all M3U8 files in the folder
-    m3u8_files = [f for f in os.listdir(folder_path) 
-                 if f.lower().endswith('.m3u8') and os.path.isfile(os.path.join(folder_path, f))]
+    m3u8_files = sorted(f for f in os.listdir(folder_path) 
+                        if f.lower().endswith('.m3u8') and os.path.isfile(os.path.join(folder_path, f)))
     
     if not m3u8_files:
         print(f"No M3U8 files found in {folder_path}")
@@ -75,66 +157,82 @@ def process_playlist_folder(plex, folder_path, threshold=0.75, create_playlists=
     print(f"Found {len(m3u8_files)} M3U8 files in {folder_path}")
     
     # Build library index once for all playlists
-    library_index = PlexLibraryIndex(plex)
-    library_index.build_index()
+    library_index, refresh = load_library_index(plex, index_cache, rebuild_index, refresh_index, duration_tolerance,
+                                                index_concurrency, page_size)
+    
+    if playlist_workers > 0 and create_playlists and not skip_confirmation:
+        print("Playlist creation needs confirmation; creating playlists one at a time")
+        playlist_workers = 0
+    
+    # Existing playlist titles are listed once for the whole run
+    catalog = PlaylistCatalog(plex) if create_playlists and skip_confirmation else None
     
     # Process each playlist
     results = {}
-    for i, m3u8_file in enumerate(m3u8_files, 1):
-        playlist_path = os.path.join(folder_path, m3u8_file)
-        playlist_name = os.path.splitext(m3u8_file)[0]
-        
-        print(f"\n[{i}/{len(m3u8_files)}] Processing playlist: {playlist_name}")
-        
-        # Parse playlist
-        tracks_info = parse_m3u8(playlist_path)
-        
-        if not tracks_info:
-            print("No tracks found in playlist!")
-            results[playlist_name] = ([], [])
-            continue
-        
-        print(f"Found {len(tracks_info)} tracks in playlist")
-        
-        # Find tracks
-        print("Finding tracks in Plex library...")
-        matched_tracks = []
-        missing_tracks = []
+    pending = deque()  # (playlist name, future) of playlists being finished in the background
+    output = _ThreadLocalStdout(sys.stdout)
+    executor = ThreadPoolExecutor(max_workers=playlist_workers) if playlist_workers > 0 else None
+    result_cache = load_match_cache(match_cache, library_index, refresh)
+    matcher = PlaylistMatcher(plex, library_index, threshold, verbose, workers, result_cache)
+    if executor is not None:
+        sys.stdout = output
+    
+    try:
+        # Parse everything up front and match each distinct track once
+        parsed = {}
+        resolved = None
+        if dedupe:
+            for m3u8_file in m3u8_files:
+                parsed[m3u8_file] = parse_m3u8(os.path.join(folder_path, m3u8_file))
+            resolved = matcher.resolve_distinct(parsed.values())
         
-        for j, track_info in enumerate(tracks_info):
-            print(f"\nProcessing track {j+1}/{len(tracks_info)}: {track_info['artist']} - {track_info['title']}")
+        for i, m3u8_file in enumerate(m3u8_files, 1):
+            playlist_path = os.path.join(folder_path, m3u8_file)
+            playlist_name = os.path.splitext(m3u8_file)[0]
+            
+            print(f"\n[{i}/{len(m3u8_files)}] Processing playlist: {playlist_name}")
+            
+            # Parse playlist, streaming it into the matcher unless it was parsed up front
+            tracks_info = parsed[m3u8_file] if dedupe else open_playlist(playlist_path)
+            
+            if not tracks_info:
+                print("No tracks found in playlist!")
+                results[playlist_name] = ([], [])
+                continue
             
-            # Find track
-            track = find_track_advanced(plex, track_info, library_index, threshold, verbose)
+            if dedupe:
+                print(f"Found {len(tracks_info)} tracks in playlist")
             
-            if track:
-                matched_tracks.append(track)
+            # Find tracks
+            if resolved is None:
+                matched_tracks, missing_tracks = matcher.match(tracks_info)
             else:
-                missing_tracks.append(track_info)
-                print(f"No match found for: {track_info['artist']} - {track_info['title']}")
-        
-        # Report results
-        match_percent = (len(matched_tracks) / len(tracks_info)) * 100 if tracks_info else 0
-        print(f"\nMatched {len(matched_tracks)} of {len(tracks_info)} tracks ({match_percent:.1f}%)")
-        
-        # Create playlist if requested
-        if create_playlists and matched_tracks:
-            if skip_confirmation:
-                # Auto-create the playlist
-                existing = [p for p in plex.playlists() if p.title == playlist_name]
-                if existing:
-                    existing[0].delete()
-                playlist = plex.createPlaylist(playlist_name, items=matched_tracks)
-                print(f"Playlist '{playlist_name}' created with {len(matched_tracks)} tracks")
+                matched_tracks, missing_tracks = split_resolved(tracks_info, resolved)
+            
+            # Report results
+            total_tracks = len(matched_tracks) + len(missing_tracks)
+            match_percent = (len(matched_tracks) / total_tracks) * 100 if total_tracks else 0
+            print(f"\nMatched {len(matched_tracks)} of {total_tracks} tracks ({match_percent:.1f}%)")
+            
+            # Create playlist and save missing tracks, in the background if enabled
+            finish_args = (plex, library_index, catalog, playlist_name, matched_tracks, missing_tracks,
+                           create_playlists, skip_confirmation, verbose)
+            if executor is None:
+                results[playlist_name] = _finish_playlist(*finish_args)
             else:
-                create_plex_playlist(plex, playlist_name, matched_tracks, skip_confirmation)
+                results[playlist_name] = None  # Keeps the summary in file order
+                pending.append((playlist_name, executor.submit(output.capture, _finish_playlist, *finish_args)))
+                _collect_finished(pending, results, wait=False)
         
-        # Save missing tracks
-        if missing_tracks:
-            missing_file = f"missing_tracks_{playlist_name}.txt"
-            save_missing_tracks(missing_tracks, missing_file, verbose=verbose)
+        _collect_finished(pending, results, wait=True)
         
-        results[playlist_name] = (matched_tracks, missing_tracks)
+        if result_cache is not None:
+            result_cache.save()
+    finally:
+        sys.stdout = output.stream
+        matcher.close()
+        if executor is not None:
+            executor.shutdown()
     
     # Print summary
     print("\n=== SUMMARY ===")
@@ -153,5 +251,58 @@ def process_playlist_folder(plex, folder_path, threshold=0.75, create_playlists=
     
     overall_percent = (total_matched / total_tracks) * 100 if total_tracks else 0
     print(f"Overall: {total_matched}/{total_tracks} tracks matched ({overall_percent:.1f}%)")
+    print(matcher.tier_summary())
+    if result_cache is not None:
+        print(result_cache.summary())
+    
+    return results
+
+def _finish_playlist(plex, library_index, catalog, playlist_name, matched_tracks, missing_tracks,
+                     create_playlists, skip_confirmation, verbose):
+    """Create or sync the Plex playlist and write the missing-track report for one matched playlist."""
+    if create_playlists and matched_tracks:
+        if skip_confirmation:
+            # Auto-sync the playlist, changing only the tracks that differ
+            sync_playlist(plex, catalog, playlist_name, [record.rating_key for record in matched_tracks])
+        else:
+            create_plex_playlist(plex, playlist_name, library_index.fetch_tracks(matched_tracks), skip_confirmation)
+    
+    # Save missing tracks
+    if missing_tracks:
+        missing_file = f"missing_tracks_{playlist_name}.txt"
+        save_missing_tracks(missing_tracks, missing_file, verbose=verbose)
+    
+    return matched_tracks, missing_tracks
+
+def _collect_finished(pending, results, wait):
+    """Print and store background results in playlist order, stopping at the first unfinished one unless waiting."""
+    while pending and (wait or pending[0][1].done()):
+        playlist_name, future = pending.popleft()
+        log, results[playlist_name] = future.result()
+        print(log, end='')
+
+class _ThreadLocalStdout:
+    """sys.stdout stand-in that sends a thread's prints to its own buffer while it captures them."""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+    
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (buffer if buffer is not None else self.stream).write(text)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
     
-    return results
\ No newline at end of file
+    def capture(self, func, *args):
+        """Call func, returning (its printed output, its result)."""
+        self.local.buffer = io.StringIO()
+        try:
+            result = func(*args)
+            return self.local.buffer.getvalue(), result
+        finally:
+            self.local.buffer = None
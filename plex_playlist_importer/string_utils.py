@@ -1,69 +1,133 @@
 import re
 import unicodedata
+from urllib.parse import unquote, urlparse
+from collections import Counter
 from difflib import SequenceMatcher
+from functools import lru_cache
 
 # Required for string similarity functions
 try:
     import Levenshtein
-    from fuzzywuzzy import fuzz
+    import numpy as np
+    from fuzzywuzzy import fuzz, utils as fuzz_utils
+    from rapidfuzz import process as rf_process
+    from rapidfuzz.distance import Indel, Levenshtein as rf_levenshtein
 except ImportError as e:
-    raise ImportError(f"Missing required package - {e}. Please install with 'pip install python-Levenshtein fuzzywuzzy'")
+    raise ImportError(f"Missing required package - {e}. Please install with "
+                      f"'pip install python-Levenshtein fuzzywuzzy numpy rapidfuzz'")
 
+# Number of trailing path components (e.g. artist/album/file) that identify a media file
+PATH_KEY_COMPONENTS = 3
+
+# Bounds for the memo caches below; entries are short strings and floats
+NORMALIZE_CACHE_SIZE = 1 << 16
+SIMILARITY_CACHE_SIZE = 1 << 17
+
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_PARENS_RE = re.compile(r'\s*\(.*?\)')
+_PAREN_CONTENT_RE = re.compile(r'\((.*?)\)')
+
+# Words get_canonical_key() ignores: a leading (or trailing) article, and "and" ("&" is already dropped by normalize_string)
+_LEADING_ARTICLES = frozenset(('the', 'a', 'an'))
+_CONJUNCTIONS = frozenset(('and', 'n'))
+
+# Weights of the individual ratios in get_multi_similarity
+SIMILARITY_WEIGHTS = {
+    'seq': 0.3,
+    'lev': 0.3,
+    'token': 0.3,
+    'base_exact': 0.5,
+    'paren': 0.2
+}
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def normalize_string(s):
     """Normalize string by removing accents, lowercasing, and removing special chars."""
     if not s:
         return ""
     
     s = s.lower()
-    s = ''.join(c for c in unicodedata.normalize('NFD', s)
-                if unicodedata.category(c) != 'Mn')
-    s = re.sub(r'[^\w\s]', ' ', s)
-    s = re.sub(r'\s+', ' ', s).strip()
+    if not s.isascii():
+        s = ''.join(c for c in unicodedata.normalize('NFD', s)
+                    if unicodedata.category(c) != 'Mn')
+    s = _NON_WORD_RE.sub(' ', s)
+    s = _WHITESPACE_RE.sub(' ', s).strip()
     
     return s
 
-def get_multi_similarity(str1, str2):
-    """Calculate string similarity using multiple algorithms and return a weighted score."""
+def get_multi_similarity(str1, str2, normalized=False, score_cutoff=None):
+    """Calculate string similarity using multiple algorithms and return a weighted score.
+
+    Pass ``normalized=True`` when both strings already went through
+    normalize_string() to skip normalizing them again. With ``score_cutoff``,
+    pairs that cannot reach the cutoff are rejected with a score of 0.0 using
+    cheap upper bounds before the expensive ratios run; every other pair gets
+    exactly the score it would get without a cutoff. Results are memoized.
+    """
+    return _multi_similarity(str1, str2, normalized, score_cutoff)
+
+@lru_cache(maxsize=SIMILARITY_CACHE_SIZE)
+def _multi_similarity(str1, str2, normalized, score_cutoff=None):
+    """Uncached implementation of get_multi_similarity()."""
     if not str1 or not str2:
         return 0.0
     
-    norm1 = normalize_string(str1)
-    norm2 = normalize_string(str2)
+    if normalized:
+        norm1, norm2 = str1, str2
+    else:
+        norm1 = normalize_string(str1)
+        norm2 = normalize_string(str2)
     
     if not norm1 or not norm2:
         return 0.0
     
-    seq_ratio = SequenceMatcher(None, norm1, norm2).ratio()
-    lev_ratio = 1 - (Levenshtein.distance(norm1, norm2) / max(len(norm1), len(norm2)))
-    token_ratio = fuzz.token_sort_ratio(norm1, norm2) / 100
-    
     if min(len(norm1), len(norm2)) <= 5:
-        if norm1 == norm2:
-            return 1.0
-        exact_word_match = norm1 in norm2.split() or norm2 in norm1.split()
-        if exact_word_match:
-            return 0.9
+        short_sim = _short_similarity(norm1, norm2)
+        if short_sim is not None:
+            return short_sim if score_cutoff is None or short_sim >= score_cutoff else 0.0
     
-    base1 = re.sub(r'\s*\(.*?\)', '', norm1).strip()
-    base2 = re.sub(r'\s*\(.*?\)', '', norm2).strip()
+    base1 = get_base_title(norm1)
+    base2 = get_base_title(norm2)
     
     base_exact_match = 1.0 if base1 == base2 and len(base1) > 3 else 0.0
     
-    paren1 = re.findall(r'\((.*?)\)', str1)
-    paren2 = re.findall(r'\((.*?)\)', str2)
+    paren1 = _PAREN_CONTENT_RE.findall(str1)
+    paren2 = _PAREN_CONTENT_RE.findall(str2)
     
     paren_sim = 0.0
     if paren1 and paren2:
         paren_sim = max(SequenceMatcher(None, p1, p2).ratio() 
                         for p1 in paren1 for p2 in paren2)
     
-    weights = {
-        'seq': 0.3,
-        'lev': 0.3,
-        'token': 0.3,
-        'base_exact': 0.5,
-        'paren': 0.2
-    }
+    if score_cutoff is not None and _below_cutoff(norm1, norm2, base_exact_match, paren_sim, score_cutoff):
+        return 0.0
+    
+    seq_ratio = SequenceMatcher(None, norm1, norm2).ratio()
+    lev_ratio = 1 - (Levenshtein.distance(norm1, norm2) / max(len(norm1), len(norm2)))
+    token_ratio = fuzz.token_sort_ratio(norm1, norm2) / 100
+    
+    normalized_sim = _blend(seq_ratio, lev_ratio, token_ratio, base_exact_match, paren_sim)
+    
+    if score_cutoff is not None and normalized_sim < score_cutoff:
+        return 0.0
+    return normalized_sim
+
+def _short_similarity(norm1, norm2):
+    """Score of the equal / whole-word shortcut for short strings, or None."""
+    if norm1 == norm2:
+        return 1.0
+    if norm1 in norm2.split() or norm2 in norm1.split():
+        return 0.9
+    return None
+
+def _blend(seq_ratio, lev_ratio, token_ratio, base_exact_match, paren_sim):
+    """Combine the individual ratios into the weighted similarity score."""
+    return min(1.0, _weighted_sum(seq_ratio, lev_ratio, token_ratio, base_exact_match, paren_sim))
+
+def _weighted_sum(seq_ratio, lev_ratio, token_ratio, base_exact_match, paren_sim):
+    """Weighted average of the individual ratios; works on floats and arrays alike."""
+    weights = SIMILARITY_WEIGHTS
     
     weighted_sim = (
         weights['seq'] * seq_ratio +
@@ -74,10 +138,166 @@ def get_multi_similarity(str1, str2):
     )
     
     total_weight = sum(weights.values())
-    normalized_sim = min(1.0, weighted_sim / total_weight)
+    return weighted_sim / total_weight
+
+def _below_cutoff(norm1, norm2, base_exact_match, paren_sim, score_cutoff):
+    """Check cheap upper bounds of the blended score against a cutoff.
+
+    SequenceMatcher and token_sort_ratio both score at most 2*M/(len1+len2)
+    and the Levenshtein ratio at most M/max(len1, len2), where M is first
+    the shorter length and then the number of characters the strings share.
+    token_sort_ratio only keeps the character counts of ASCII input (it
+    drops other characters) and rounds to whole percents, hence the
+    fallback to 1.0 and the extra 0.005.
+    """
+    len1, len2 = len(norm1), len(norm2)
+    ascii_only = norm1.isascii() and norm2.isascii()
     
-    return normalized_sim
+    def bound(matches):
+        overlap_ratio = 2 * matches / (len1 + len2)
+        token_bound = min(1.0, overlap_ratio + 0.005) if ascii_only else 1.0
+        return _blend(overlap_ratio, matches / max(len1, len2), token_bound, base_exact_match, paren_sim)
+    
+    # The float slack keeps rounding in the bound from rejecting an exact tie
+    if bound(min(len1, len2)) + 1e-9 < score_cutoff:
+        return True
+    
+    shared = sum((Counter(norm1) & Counter(norm2)).values())
+    return bound(shared) + 1e-9 < score_cutoff
+
+def score_many(query, candidates, normalized=False, score_cutoff=None):
+    """Score one string against many candidates; see score_matrix()."""
+    return score_matrix([query], candidates, normalized, score_cutoff)[0]
+
+def score_matrix(queries, candidates, normalized=False, score_cutoff=None):
+    """Score every query against every candidate in one batch.
 
+    Returns a float array of shape (len(queries), len(candidates)) holding
+    exactly what get_multi_similarity(query, candidate, normalized,
+    score_cutoff) returns for each pair. The Levenshtein and token ratios
+    come from rapidfuzz's native cdist. difflib's ratio has no native
+    equivalent, so it only runs for pairs whose blend can still reach the
+    cutoff when the Indel ratio (an upper bound of it) stands in.
+    """
+    queries = list(queries)
+    candidates = list(candidates)
+    scores = np.zeros((len(queries), len(candidates)))
+    if not queries or not candidates:
+        return scores
+    
+    if normalized:
+        query_norms, cand_norms = queries, candidates
+    else:
+        query_norms = [normalize_string(q) if q else "" for q in queries]
+        cand_norms = [normalize_string(c) if c else "" for c in candidates]
+    
+    query_lens = np.array([len(n) for n in query_norms])
+    cand_lens = np.array([len(n) for n in cand_norms])
+    valid = np.outer(query_lens > 0, cand_lens > 0)
+    max_lens = np.maximum(np.maximum.outer(query_lens, cand_lens), 1)
+    
+    lev_ratio = 1 - (rf_process.cdist(query_norms, cand_norms, scorer=rf_levenshtein.distance,
+                                         dtype=np.int64) / max_lens)
+    
+    query_tokens = [_sorted_tokens(n) for n in query_norms]
+    cand_tokens = [_sorted_tokens(n) for n in cand_norms]
+    token_ratio = rf_process.cdist(query_tokens, cand_tokens, scorer=Indel.normalized_similarity,
+                                   dtype=np.float64)
+    token_ratio = np.round(100 * token_ratio) / 100
+    
+    base_ids = {}
+    query_bases = np.array([_base_id(n, base_ids) for n in query_norms])
+    cand_bases = np.array([_base_id(n, base_ids) for n in cand_norms])
+    base_exact_match = np.equal.outer(query_bases, cand_bases) & np.outer(query_bases >= 0, cand_bases >= 0)
+    base_exact_match = base_exact_match.astype(float)
+    
+    paren_sim = np.zeros_like(scores)
+    query_parens = [_PAREN_CONTENT_RE.findall(q) if q else [] for q in queries]
+    cand_parens = [_PAREN_CONTENT_RE.findall(c) if c else [] for c in candidates]
+    paren_cands = [j for j, parens in enumerate(cand_parens) if parens]
+    for i, paren1 in enumerate(query_parens):
+        if not paren1:
+            continue
+        for j in paren_cands:
+            paren_sim[i, j] = max(SequenceMatcher(None, p1, p2).ratio()
+                                  for p1 in paren1 for p2 in cand_parens[j])
+    
+    shortcut = np.zeros_like(scores, dtype=bool)
+    short_pairs = valid & (np.minimum.outer(query_lens, cand_lens) <= 5)
+    for i, j in zip(*np.nonzero(short_pairs)):
+        short_sim = _short_similarity(query_norms[i], cand_norms[j])
+        if short_sim is not None:
+            scores[i, j] = short_sim
+            shortcut[i, j] = True
+    
+    needed = valid & ~shortcut
+    if score_cutoff is not None:
+        seq_bound = rf_process.cdist(query_norms, cand_norms, scorer=Indel.normalized_similarity,
+                                     dtype=np.float64)
+        bound = _weighted_sum(seq_bound, lev_ratio, token_ratio, base_exact_match, paren_sim)
+        needed &= bound + 1e-9 >= score_cutoff
+    
+    seq_ratio = np.zeros_like(scores)
+    for i, j in zip(*np.nonzero(needed)):
+        seq_ratio[i, j] = SequenceMatcher(None, query_norms[i], cand_norms[j]).ratio()
+    
+    blended = np.minimum(1.0, _weighted_sum(seq_ratio, lev_ratio, token_ratio, base_exact_match, paren_sim))
+    scores[needed] = blended[needed]
+    
+    if score_cutoff is not None:
+        scores[scores < score_cutoff] = 0.0
+    return scores
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def _sorted_tokens(norm):
+    """Preprocess a string the way fuzz.token_sort_ratio does."""
+    return " ".join(sorted(fuzz_utils.full_process(norm, force_ascii=True).split()))
+
+def _base_id(norm, base_ids):
+    """Map the base title of a string to a shared id, or -1 if it is too short to count."""
+    base = get_base_title(norm)
+    if len(base) <= 3:
+        return -1
+    return base_ids.setdefault(base, len(base_ids))
+
+def get_base_title(title):
+    """Strip parenthesized parts such as '(Remastered)' from a title."""
+    return _PARENS_RE.sub('', title).strip()
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def get_canonical_key(norm):
+    """Key of a normalized string that ignores word order, a leading or trailing article, "and" and word breaks.
+
+    The remaining words are sorted and joined without spaces, so "The Love
+    & Hate", "Hate and Love" and "lovehate" share a key, as do "ac dc"
+    (from "AC/DC") and "acdc".
+    """
+    words = norm.split()
+    if len(words) > 1 and words[0] in _LEADING_ARTICLES:
+        words = words[1:]
+    elif len(words) > 1 and words[-1] in _LEADING_ARTICLES:
+        words = words[:-1]  # "Beatles, The"
+    words = [word for word in words if word not in _CONJUNCTIONS] or words
+    return ''.join(sorted(words))
+
+def get_length_bound(len1, len2):
+    """Upper bound of get_multi_similarity for two normalized strings of the given lengths.
+
+    Normalized strings have no parentheses, so only the exact base match can
+    add to the sequence, Levenshtein and token ratios, and it needs equal
+    lengths. Short strings may take the whole-word shortcut, so they are
+    never bounded below 1.0.
+    """
+    if not len1 or not len2:
+        return 0.0
+    if min(len1, len2) <= 5:
+        return 1.0
+    
+    overlap_ratio = 2 * min(len1, len2) / (len1 + len2)
+    return _blend(overlap_ratio, min(len1, len2) / max(len1, len2), min(1.0, overlap_ratio + 0.005),
+                  1.0 if len1 == len2 else 0.0, 0.0)
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
 def clean_title_for_search(title):
     """Clean a title specifically for search purposes."""
     if not title:
@@ -98,4 +318,30 @@ def clean_title_for_search(title):
     cleaned = re.sub(r'\.\.\.', '', cleaned)
     cleaned = cleaned.replace('/', ' ')
     
-    return cleaned.strip()
\ No newline at end of file
+    return cleaned.strip()
+
+def get_ngrams(s, n=3):
+    """Return the character n-grams of a string, padded with a space on both ends."""
+    if not s:
+        return []
+    
+    padded = f" {s} "
+    return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+def get_path_key(path, components=PATH_KEY_COMPONENTS):
+    """Key a media file path by its last few components, so playlist paths can be matched to Plex files.
+
+    Both separators and file:// URLs are accepted; the key is NFC-normalized
+    and case-folded. Returns None for paths with fewer components.
+    """
+    if not path:
+        return None
+    
+    if path.startswith('file:'):
+        path = unquote(urlparse(path).path)
+    
+    parts = [part for part in path.replace('\\', '/').split('/') if part]
+    if len(parts) < components:
+        return None
+    
+    return unicodedata.normalize('NFC', '/'.join(parts[-components:])).casefold()
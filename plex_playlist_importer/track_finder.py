@@ -2,15 +2,61 @@ import re
 from .string_utils import clean_title_for_search
 from .library_index import PlexLibraryIndex
 
-def find_track_advanced(plex, track_info, library_index=None, threshold=0.75, verbose=False):
-    """Advanced track finding function that uses the indexed library."""
+def find_track_advanced(plex, track_info, library_index=None, threshold=0.75, verbose=False, match_cache=None):
+    """Advanced track finding function that uses the indexed library.
+
+    Returns the matched track record from the index, or None. A MatchCache
+    passed as ``match_cache`` is consulted before any index work and
+    updated with the result.
+    """
+    best_match = find_best_match(plex, track_info, library_index, threshold, verbose, match_cache)
+    return best_match['track'] if best_match else None
+
+def find_best_match(plex, track_info, library_index=None, threshold=0.75, verbose=False, match_cache=None):
+    """Like find_track_advanced(), but return the accepted match dict (with its score) or None."""
+    if match_cache is None or library_index is None or not library_index.initialized:
+        return _search_best_match(plex, track_info, library_index, threshold, verbose)
+    
+    cached = match_cache.lookup(track_info, threshold, library_index)
+    if cached is not None:
+        print(f"Searching: {track_info['artist']} - {track_info['title']}")
+        return _cached_match(library_index, *cached)
+    
+    best_match = _search_best_match(plex, track_info, library_index, threshold, verbose)
+    if best_match:
+        match_cache.store(track_info, threshold, best_match['track'].rating_key, best_match['score'],
+                          best_match.get('tier'))
+    else:
+        match_cache.store(track_info, threshold, None, None)
+    return best_match
+
+def _cached_match(library_index, rating_key, score):
+    """Turn a cached result back into a (reduced) match dict, or None for a cached miss."""
+    if rating_key is None:
+        print("  No match (cached)")
+        return None
+    
+    return _record_match(library_index, library_index.tracks[rating_key], score, 'cached')
+
+def _record_match(library_index, record, score, tier):
+    """Build a reduced match dict for a track found without similarity scoring."""
+    artist = library_index.artists.get(record.artist_key)
+    artist_name = artist.title if artist else ''
+    print(f"  Found match ({tier}): {artist_name} - {record.title}")
+    return {'track': record, 'artist_name': artist_name, 'score': score, 'tier': tier}
+
+def _search_best_match(plex, track_info, library_index, threshold, verbose):
+    """Search the index for a playlist entry; return the accepted match dict or None."""
     artist = track_info['artist']
     title = track_info['title']
     album = track_info.get('album', None)
+    duration = track_info.get('duration')
     
     print(f"Searching: {artist} - {title}")
     if verbose and album:
         print(f"  Album: {album}")
+    if verbose and duration:
+        print(f"  Duration: {duration}s")
     
     # Special handling for songs with featured artists
     if 'feat.' in title or 'with' in title or '...' in title:
@@ -24,8 +70,13 @@ def find_track_advanced(plex, track_info, library_index=None, threshold=0.75, ve
         library_index = PlexLibraryIndex(plex)
         library_index.build_index()
     
+    # Exported playlists usually point at the very files Plex scanned
+    record = library_index.find_by_path(track_info.get('path'))
+    if record is not None:
+        return _record_match(library_index, record, 1.0, 'path')
+    
     # Find potential matches
-    matches = library_index.find_track(artist, title, album)
+    matches = library_index.find_track(artist, title, album, duration)
     
     # For specific problematic tracks, lower the threshold slightly
     current_threshold = threshold
@@ -55,14 +106,14 @@ def find_track_advanced(plex, track_info, library_index=None, threshold=0.75, ve
             base_title = re.sub(r'\s*\(.*?\)', '', title).strip()
             alt_titles.append(base_title)
         
-        # Try each alternative title
-        for alt_title in alt_titles:
-            if alt_title != title:
-                print(f"  Trying alternative title: '{alt_title}'")
-                alt_matches = library_index.find_track(artist, alt_title, album)
-                
-                if alt_matches and (not matches or alt_matches[0]['score'] > matches[0]['score']):
-                    matches = alt_matches
+        # Try all alternative titles in one query
+        alt_titles = [alt_title for alt_title in dict.fromkeys(alt_titles) if alt_title != title]
+        if alt_titles:
+            print(f"  Trying alternative titles: {', '.join(repr(alt_title) for alt_title in alt_titles)}")
+            alt_matches = library_index.find_track_variants(artist, alt_titles, album, duration)
+            
+            if alt_matches and (not matches or alt_matches[0]['score'] > matches[0]['score']):
+                matches = alt_matches
     
     if matches:
         best_match = matches[0]
@@ -79,7 +130,7 @@ def find_track_advanced(plex, track_info, library_index=None, threshold=0.75, ve
         # Accept match if score is above threshold
         if best_match['score'] >= current_threshold:
             print(f"  Found match: {best_match['artist_name']} - {best_match['track'].title}")
-            return best_match['track']
+            return best_match
         else:
             print(f" Best match below threshold ({best_match['score']:.4f} < {current_threshold})")
             print(f" Rejected: {best_match['artist_name']} - {best_match['track'].title}")